@@ -10,6 +10,7 @@ import { useEffect, useRef } from 'react'
 import { useDispatch } from 'react-redux'
 import { webSocketActions } from './store/webSocketSlice'
 import ErrorPage from './pages/ErrorPage'
+import { addOverlay } from './util/overlays'
 
 const router = createBrowserRouter([
   {
@@ -41,7 +42,13 @@ function App() {
     socket.current = new WebSocket('ws://localhost:8765');
     if (socket.current) {
       socket.current.onmessage = e => {
-        dispatch(webSocketActions.setScatter(JSON.parse(e.data).scatter));
+        const data = JSON.parse(e.data);
+        if (data.scatter) {
+          dispatch(webSocketActions.setScatter(data.scatter));
+        }
+        if (data.overlay) {
+          addOverlay(data.overlay);
+        }
       };
     }
     return () => socket.current?.close();
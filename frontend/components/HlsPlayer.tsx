@@ -1,17 +1,57 @@
 import { useEffect, forwardRef, useImperativeHandle, useRef } from 'react';
-import Hls from 'hls.js';
-import { IHlsPlayer } from '../util/interfaces';
+import Hls, { Fragment } from 'hls.js';
+import { IHlsPlayer, IOverlay } from '../util/interfaces';
+import { findOverlay, SEGMENT_SECONDS } from '../util/overlays';
+
+/**
+ * Draws an overlay's boxes and track IDs onto a canvas covering the video.
+ * Coordinates are scaled from the frame to the picture shown, which the video letterboxes to keep its aspect ratio.
+ */
+const drawOverlay = (canvas: HTMLCanvasElement, video: HTMLVideoElement, overlay: IOverlay | null) => {
+  const context = canvas.getContext('2d');
+  if (!context) return;
+
+  if (canvas.width !== video.clientWidth || canvas.height !== video.clientHeight) {
+    canvas.width = video.clientWidth;
+    canvas.height = video.clientHeight;
+  }
+  context.clearRect(0, 0, canvas.width, canvas.height);
+  if (!overlay || !video.videoWidth || !video.videoHeight) return;
+
+  const fit = Math.min(canvas.width / video.videoWidth, canvas.height / video.videoHeight);
+  const left = (canvas.width - video.videoWidth * fit) / 2;
+  const top = (canvas.height - video.videoHeight * fit) / 2;
+  const scaleX = video.videoWidth * fit / overlay.width;
+  const scaleY = video.videoHeight * fit / overlay.height;
+
+  context.lineWidth = 2;
+  context.strokeStyle = '#ff3838';
+  overlay.boxes?.forEach(([x1, y1, x2, y2]) => {
+    context.strokeRect(left + x1 * scaleX, top + y1 * scaleY, (x2 - x1) * scaleX, (y2 - y1) * scaleY);
+  });
+
+  context.font = 'bold 16px sans-serif';
+  context.fillStyle = '#00ff00';
+  overlay.tracks.forEach(({ id, x, y }) => {
+    context.fillText(`${id}`, left + x * scaleX, top + y * scaleY);
+  });
+};
 
 /**
  * HLS Player component that uses hls.js to play HLS streams in browsers that do not support it natively.
+ * When given an overlay camera, the detections and 2D tracks the server sent for each frame are drawn over it.
  * @param {string} src - The source URL of the HLS stream.
+ * @param {number} overlayCamera - The camera whose overlays to draw, none if undefined.
  * @param {React.Ref} ref - A ref to the video element.
  * @param {React.HTMLProps<HTMLVideoElement>} props - Additional props for the video element.
  * @returns {JSX.Element} The HLS player component.
  */
 const HlsPlayer = forwardRef<HTMLVideoElement, IHlsPlayer>(
-  ({ src, ...props }, ref) => {
+  ({ src, overlayCamera, ...props }, ref) => {
     const videoRef = useRef<HTMLVideoElement>(null);
+    const canvasRef = useRef<HTMLCanvasElement>(null);
+    // The segment playing, which places the video's clock within the server's stream
+    const fragmentRef = useRef<Fragment | null>(null);
     useImperativeHandle(ref, () => videoRef.current!);
 
     useEffect(() => {
@@ -21,6 +61,7 @@ const HlsPlayer = forwardRef<HTMLVideoElement, IHlsPlayer>(
 
       // Check if the browser supports HLS natively
       if (video.canPlayType('application/vnd.apple.mpegurl')) {
+        // Native playback does not say which segment is playing, so overlays cannot be lined up and are not drawn
         video.src = src;
         video.addEventListener('loadedmetadata', () => {
           video.play();
@@ -33,20 +74,53 @@ const HlsPlayer = forwardRef<HTMLVideoElement, IHlsPlayer>(
         hls.on(Hls.Events.MANIFEST_PARSED, () => {
           video.play();
         });
+        hls.on(Hls.Events.FRAG_CHANGED, (_, data) => {
+          fragmentRef.current = data.frag;
+        });
 
         return () => {
+          fragmentRef.current = null;
           hls.destroy();
         };
       }
     }, [src]);
 
+    useEffect(() => {
+      if (overlayCamera === undefined) return;
+
+      let frame = 0;
+      const draw = () => {
+        const video = videoRef.current;
+        const canvas = canvasRef.current;
+        const fragment = fragmentRef.current;
+        if (video && canvas) {
+          const sequence = typeof fragment?.sn === 'number' ? fragment.sn : null;
+          const time = sequence !== null ? sequence * SEGMENT_SECONDS + video.currentTime - fragment!.start : null;
+          drawOverlay(canvas, video, time !== null ? findOverlay(overlayCamera, time) : null);
+        }
+        frame = requestAnimationFrame(draw);
+      };
+      frame = requestAnimationFrame(draw);
+
+      return () => cancelAnimationFrame(frame);
+    }, [overlayCamera]);
+
     return (
-      <video
-        ref={videoRef}
-        {...props}
-      />
+      <div style={{ position: 'relative', display: 'inline-block' }}>
+        <video
+          ref={videoRef}
+          {...props}
+        />
+        {overlayCamera !== undefined && (
+          <canvas
+            ref={canvasRef}
+            // Sized to the video in drawOverlay
+            style={{ position: 'absolute', top: 0, left: 0, pointerEvents: 'none' }}
+          />
+        )}
+      </div>
     );
   }
 );
 
-export default HlsPlayer;
\ No newline at end of file
+export default HlsPlayer;
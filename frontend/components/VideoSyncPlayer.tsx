@@ -8,6 +8,7 @@ import placeholder from '../../public/favicon.ico';
  * VideoSyncPlayer component that synchronizes two HLS video players.
  * It allows for adjusting the delay between the two videos, changing playback speed, and pausing both videos simultaneously.
  * It also provides a "Live" button to reset the delay and set both videos to their end time.
+ * Detection boxes and track IDs sent by the server are drawn over each video and can be toggled off.
  * @returns {JSX.Element} The VideoSyncPlayer component.
  * */
 const VideoSyncPlayer = () => {
@@ -17,6 +18,7 @@ const VideoSyncPlayer = () => {
   const [delay, setDelay] = useState(0);
   const [playbackRate, setPlaybackRate] = useState<number>(1);
   const [pause, setPause] = useState(false);
+  const [overlays, setOverlays] = useState(true);
 
   const videos = [video1Ref, video2Ref];
 
@@ -78,6 +80,7 @@ const VideoSyncPlayer = () => {
           className={classes.video}
           ref={video1Ref}
           src="http://192.168.2.162:8080/deep/playlist.m3u8"
+          overlayCamera={overlays ? 0 : undefined}
           controls={false}
           onClick={() => video1Ref.current?.requestFullscreen()}
           poster={placeholder}
@@ -86,6 +89,7 @@ const VideoSyncPlayer = () => {
           className={classes.video}
           ref={video2Ref}
           src="http://192.168.2.162:8080/wide/playlist.m3u8"
+          overlayCamera={overlays ? 1 : undefined}
           controls={false}
           onClick={() => video1Ref.current?.requestFullscreen()}
           poster={placeholder}
@@ -110,6 +114,9 @@ const VideoSyncPlayer = () => {
         <button onClick={handleLive}>
           Live
         </button>
+        <button onClick={() => setOverlays(shown => !shown)}>
+          Overlays: {overlays ? "On" : "Off"}
+        </button>
       </div>
     </div>
   );
@@ -9,6 +9,8 @@ export interface ISidebarItem {
 
 export interface IHlsPlayer extends React.VideoHTMLAttributes<HTMLVideoElement> {
     src: string;
+    // Camera whose detection boxes and 2D track IDs are drawn over the video, none if undefined
+    overlayCamera?: number;
 }
 
 export interface IScatter3dOld extends React.HTMLAttributes<HTMLDivElement> {
@@ -31,8 +33,40 @@ export interface IScatter3dData {
         y: number,
         z: number
     };
+    // Smoothed estimates in mm/s and mm/s², on the same axes as the coordinates
+    velocity?: {
+        x: number,
+        y: number,
+        z: number
+    };
+    acceleration?: {
+        x: number,
+        y: number,
+        z: number
+    };
+    // False while the position is predicted because a camera has lost the object
+    measured?: boolean;
 }
 
 export interface IScatter3dDataLive extends IScatter3dData {
     track: boolean;
-}
\ No newline at end of file
+}
+
+// Detections and 2D tracks of one encoded frame, drawn over the video by the browser
+export interface IOverlay {
+    camera: number;
+    // Seconds into the camera's HLS stream
+    time: number;
+    // Capture time on the server in seconds since the epoch
+    timestamp: number;
+    // Frame size the coordinates are in
+    width: number;
+    height: number;
+    // [x1, y1, x2, y2, confidence] per detection, null on frames whose positions were predicted
+    boxes: number[][] | null;
+    tracks: {
+        id: number,
+        x: number,
+        y: number
+    }[];
+}
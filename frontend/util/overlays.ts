@@ -0,0 +1,59 @@
+import { IOverlay } from "./interfaces";
+
+// Must match SEGMENT_SECONDS in pc_server/main/output.py, segment n of a stream starts n * SEGMENT_SECONDS into it
+export const SEGMENT_SECONDS = 4;
+// Overlays kept per camera, enough to cover the oldest segment the players can seek back to
+const HISTORY_SECONDS = 64;
+
+// Overlays arrive for every frame and are only read while drawing, so they are kept here rather than in Redux
+const buffers = new Map<number, IOverlay[]>();
+
+/**
+ * Stores an overlay received from the server, in order of its time in the stream.
+ * @param {IOverlay} overlay - Detections and tracks of one encoded frame.
+ */
+export const addOverlay = (overlay: IOverlay) => {
+    let buffer = buffers.get(overlay.camera);
+    if (!buffer) {
+        buffer = [];
+        buffers.set(overlay.camera, buffer);
+    }
+    // The server restarted, so stream times start again from 0
+    if (buffer.length && overlay.time < buffer[buffer.length - 1].time) {
+        buffer.length = 0;
+    }
+    buffer.push(overlay);
+
+    let expired = 0;
+    while (buffer[expired].time < overlay.time - HISTORY_SECONDS) expired++;
+    if (expired) buffer.splice(0, expired);
+};
+
+/**
+ * Finds the overlay of the frame showing at a point in a camera's stream.
+ * @param {number} camera - Camera index.
+ * @param {number} time - Seconds into the camera's stream.
+ * @param {number} tolerance - How old the last overlay may be before nothing is drawn.
+ * @returns {IOverlay | null} The latest overlay at or before the time, or null if there is none.
+ */
+export const findOverlay = (camera: number, time: number, tolerance = 0.5): IOverlay | null => {
+    const buffer = buffers.get(camera);
+    if (!buffer) return null;
+
+    // Binary search for the last overlay at or before the time, allowing for rounding of the video's clock
+    let low = 0;
+    let high = buffer.length - 1;
+    let found = -1;
+    while (low <= high) {
+        const middle = (low + high) >> 1;
+        if (buffer[middle].time <= time + 0.001) {
+            found = middle;
+            low = middle + 1;
+        } else {
+            high = middle - 1;
+        }
+    }
+
+    if (found < 0 || time - buffer[found].time > tolerance) return null;
+    return buffer[found];
+};
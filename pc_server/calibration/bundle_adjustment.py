@@ -0,0 +1,111 @@
+###
+# Refine the second camera's pose and the gathered 3D points together by minimising reprojection error
+###
+
+from typing import Tuple
+import cv2
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.sparse import lil_matrix
+
+def rotate(rvecs: np.ndarray, points: np.ndarray) -> np.ndarray:
+    """
+    Rotates (N, 3) points by matching (N, 3) rotation vectors with Rodrigues' formula
+    """
+    theta = np.linalg.norm(rvecs, axis=1, keepdims=True)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        axis = np.nan_to_num(rvecs / theta)
+    cos, sin = np.cos(theta), np.sin(theta)
+    dot = np.sum(axis * points, axis=1, keepdims=True)
+    return cos * points + sin * np.cross(axis, points) + dot * (1 - cos) * axis
+
+def project(points: np.ndarray, rvec: np.ndarray, tvec: np.ndarray, K: np.ndarray) -> np.ndarray:
+    """
+    Pixel coordinates of (N, 3) points seen by a camera with pose (rvec, tvec) and matrix K
+    """
+    camera = rotate(np.broadcast_to(rvec, points.shape), points) + tvec
+    pixels = camera @ K.T
+    return pixels[:, :2] / pixels[:, 2:]
+
+def reprojection_errors(pts1: np.ndarray, pts2: np.ndarray, points: np.ndarray,
+                        K1: np.ndarray, K2: np.ndarray, rvec: np.ndarray, tvec: np.ndarray) -> Tuple[float, float]:
+    """
+    RMS reprojection error in pixels in each camera, with the first camera at the origin
+    """
+    first = project(points, np.zeros(3), np.zeros(3), K1) - pts1
+    second = project(points, rvec, tvec, K2) - pts2
+    return float(np.sqrt(np.mean(np.sum(first ** 2, axis=1)))), float(np.sqrt(np.mean(np.sum(second ** 2, axis=1))))
+
+def refine_extrinsics(pts1: np.ndarray, pts2: np.ndarray, K1: np.ndarray, K2: np.ndarray, R: np.ndarray, t: np.ndarray,
+                      loss: str = "huber", scale: float = 2.) -> Tuple[np.ndarray, np.ndarray, np.ndarray, dict]:
+    """
+    Sparse bundle adjustment of the second camera's pose and every gathered point
+    The first camera defines the coordinate frame, as in P1 = K1 [I | 0], and the baseline keeps its length,
+    since neither can be recovered from the images. Each point's residuals only depend on that point and
+    the second camera's pose, so the Jacobian is given to the solver as a sparsity pattern and thousands of
+    points solve in well under a second.
+
+    Args:
+        pts1 (np.ndarray): (N, 2) undistorted points in the first camera
+        pts2 (np.ndarray): (N, 2) the same points in the second camera
+        K1, K2 (np.ndarray): Camera matrices
+        R, t (np.ndarray): Initial pose of the second camera, e.g. from cv2.recoverPose
+        loss (str): Robust loss, so a few mismatched points cannot drag the pose
+        scale (float): Reprojection error in pixels beyond which the loss stops growing quadratically
+
+    Returns:
+        np.ndarray: Refined rotation of the second camera
+        np.ndarray: Refined (3, 1) translation of the second camera
+        np.ndarray: (N, 3) refined points in the first camera's frame
+        dict: RMS reprojection error per camera before and after refinement
+    """
+    pts1 = np.asarray(pts1, dtype=np.float64).reshape(-1, 2)
+    pts2 = np.asarray(pts2, dtype=np.float64).reshape(-1, 2)
+    count = len(pts1)
+    rvec = cv2.Rodrigues(np.asarray(R, dtype=np.float64))[0].ravel()
+    tvec = np.asarray(t, dtype=np.float64).ravel()
+    baseline = np.linalg.norm(tvec)
+
+    P1 = K1 @ np.hstack((np.eye(3), np.zeros((3, 1))))
+    P2 = K2 @ np.hstack((cv2.Rodrigues(rvec)[0], tvec[:, None]))
+    homogeneous = cv2.triangulatePoints(P1, P2, pts1.T, pts2.T)
+    points = (homogeneous[:3] / homogeneous[3]).T
+
+    def residuals(params: np.ndarray) -> np.ndarray:
+        rvec, tvec, points = params[:3], params[3:6], params[6:].reshape(-1, 3)
+        first = project(points, np.zeros(3), np.zeros(3), K1) - pts1
+        second = project(points, rvec, tvec, K2) - pts2
+        # One extra residual pins the baseline's length
+        return np.concatenate((first.ravel(), second.ravel(), [np.linalg.norm(tvec) - baseline]))
+
+    # Rows: 2 per point in the first camera, 2 per point in the second, then the baseline
+    sparsity = lil_matrix((4 * count + 1, 6 + 3 * count), dtype=np.uint8)
+    point_columns = 6 + 3 * np.arange(count)
+    for axis in range(3):
+        for coordinate in range(2):
+            sparsity[2 * np.arange(count) + coordinate, point_columns + axis] = 1
+            sparsity[2 * count + 2 * np.arange(count) + coordinate, point_columns + axis] = 1
+    sparsity[2 * count:4 * count, :6] = 1
+    sparsity[4 * count, 3:6] = 1
+
+    before = reprojection_errors(pts1, pts2, points, K1, K2, rvec, tvec)
+    params = np.concatenate((rvec, tvec, points.ravel()))
+    # A robust loss from a poor start treats every point as an outlier, so converge on plain least squares first
+    for stage_loss in dict.fromkeys(("linear", loss)):
+        params = least_squares(
+            residuals,
+            params,
+            jac_sparsity=sparsity,
+            x_scale="jac",
+            method="trf",
+            loss=stage_loss,
+            f_scale=scale,
+        ).x
+    rvec, tvec, points = params[:3], params[3:6], params[6:].reshape(-1, 3)
+    after = reprojection_errors(pts1, pts2, points, K1, K2, rvec, tvec)
+
+    report = {
+        "before": {"camera 1": before[0], "camera 2": before[1]},
+        "after": {"camera 1": after[0], "camera 2": after[1]},
+    }
+    return cv2.Rodrigues(rvec)[0], tvec[:, None], points, report
@@ -4,7 +4,21 @@ import cv2
 import numpy as np
 from capture import LatestResults
 from calibration import get_projection_matrix, gather_points, position
+from tracking import undistort_points
+from calibration_store import fundamental_from_projections
+from bundle_adjustment import refine_extrinsics
+from intrinsics import INTRINSICS
 import json
+import os
+
+# Written with everything the server needs, including the intrinsics used, so they always match the projections
+PARAMS = "camera_params.json"
+# Intrinsics and lens distortion are read from INTRINSICS when intrinsics.py has written them.
+# Otherwise, when set, measure them from a 7x7 chessboard before gathering points,
+# or else use the last measured intrinsics below, without distortion correction
+CALIBRATE_INTRINSICS = False
+# Jointly refine the second camera's pose and the gathered points by bundle adjustment after recovering the pose
+REFINE_EXTRINSICS = True
 
 if __name__ == "__main__":
     calibrator = CameraCalibrator((640, 640))
@@ -14,35 +28,50 @@ if __name__ == "__main__":
     cap = LatestResults()
     cap.start()
 
-    # params = [[], []]
-    # for i in range(2):
-    #     params.append(get_projection_matrix(cap, i))
+    if os.path.exists(INTRINSICS):
+        with open(INTRINSICS) as f:
+            saved = json.load(f)
+        K1, D1, K2, D2 = (np.array(saved[key]) for key in ("K1", "D1", "K2", "D2"))
+        print(f"Using intrinsics from {INTRINSICS}")
+    elif CALIBRATE_INTRINSICS:
+        intrinsics = [get_projection_matrix(cap, i) for i in range(2)]
+        (_, K1, D1, _, _), (_, K2, D2, _, _) = intrinsics
+    else:
+        K1 = np.array([
+            [1004.6, 0, 335.59],
+            [0, 991.47, 273.95],
+            [0, 0, 1]
+        ])
+
+        K2 = np.array([
+            [928.95, 0, 289.87],
+            [0, 927.31, 296.52],
+            [0, 0, 1]
+        ])
+        D1 = np.zeros(5)
+        D2 = np.zeros(5)
 
     pts1, pts2 = gather_points(calibrator, cap, track2d, track3d)
+    calibrator.save_rois()
 
     cap.stop()
     cv2.destroyAllWindows()
 
-    F, mask = cv2.findFundamentalMat(pts1, pts2, method=cv2.FM_RANSAC)
-
-    # K1 = params[0][1]
-    # K2 = params[1][1]
-    K1 = np.array([
-        [1004.6, 0, 335.59],
-        [0, 991.47, 273.95],
-        [0, 0, 1]
-    ])
+    # Everything from here on, and Track3D's matching and triangulation, works in undistorted pixels
+    pts1 = undistort_points(pts1, K1, D1)
+    pts2 = undistort_points(pts2, K2, D2)
 
-    K2 = np.array([
-        [928.95, 0, 289.87],
-        [0, 927.31, 296.52],
-        [0, 0, 1]
-    ])
+    F, mask = cv2.findFundamentalMat(pts1, pts2, method=cv2.FM_RANSAC)
 
     E = K2.T @ F @ K1
     # Inputs: Essential matrix and matching points (normalized coordinates if already undistorted)
     points, R, t, mask = cv2.recoverPose(E, pts1, pts2, K1)
 
+    if REFINE_EXTRINSICS:
+        R, t, _, report = refine_extrinsics(pts1, pts2, K1, K2, R, t)
+        for stage, errors in report.items():
+            print(f"Reprojection error {stage} refinement: " + ", ".join(f"{camera} {error:.3f} px" for camera, error in errors.items()))
+
     extrinsic = np.hstack((R, t))  # shape (3, 4)
 
     print(f"F: {F} R: {R}, t: {t}, extrinsic: {extrinsic}")
@@ -59,6 +88,11 @@ if __name__ == "__main__":
     P2 = K2 @ np.hstack((R, t))
     print("P2: ", P2)
 
+    if REFINE_EXTRINSICS:
+        # Keep F consistent with the refined pose, as Track3D matches with it
+        F = fundamental_from_projections(P1, P2)
+        F /= F[2, 2]
+
     offsets, scales = position(pts1, pts2, P1, P2)
     print("Offsets: ", offsets)
     print("Scales: ", scales)
@@ -68,6 +102,8 @@ if __name__ == "__main__":
         "mask": mask.tolist(),
         "K1": K1.tolist(),
         "K2": K2.tolist(),
+        "D1": np.ravel(D1).tolist(),
+        "D2": np.ravel(D2).tolist(),
         "P1": P1.tolist(),
         "P2": P2.tolist(),
         "offsets": offsets,
@@ -76,6 +112,6 @@ if __name__ == "__main__":
 
     json_str = json.dumps(params, indent=2)
 
-    with open("camera_params.json", "w") as f:
+    with open(PARAMS, "w") as f:
         f.write(json_str)
-    print("Parameters saved to camera_params.json")
\ No newline at end of file
+    print(f"Parameters saved to {PARAMS}")
\ No newline at end of file
@@ -1,4 +1,5 @@
 import cv2
+import json
 from output import Trackbars
 from ultralytics.engine.results import Results
 from typing import List, Dict, Tuple
@@ -15,13 +16,10 @@ class CameraCalibrator:
     Position the subjects edges at the boundaries of the camera view.
     Set threshold according to the camera's perspective.
     """
-    def __init__(self, resolution):
+    def __init__(self, resolution, cameras: int = 2):
         width, height = resolution
         params = [("Top", height), ("Bottom", height), ("Left", width), ("Right", width)]
-        self.trackbars = [
-            Trackbars("Camera 0 Params", params), 
-            Trackbars("Camera 1 Params", params)
-        ]
+        self.trackbars = [Trackbars(f"Camera {i} Params", params) for i in range(cameras)]
         self.threshold = Trackbars("Threshold", [("Heightwise", height)])
         self.width = width
         self.height = height
@@ -54,6 +52,23 @@ class CameraCalibrator:
 
         return dfs
     
+    def rois(self) -> List[Tuple[int, int, int, int]]:
+        """
+        The tank bounds of each camera as (x0, y0, x1, y1) regions of interest
+        """
+        return [
+            (trackbar["Left"], trackbar["Top"], self.width - trackbar["Right"], self.height - trackbar["Bottom"])
+            for trackbar in self.trackbars
+        ]
+
+    def save_rois(self, path: str = "rois.json"):
+        """
+        Persists the tank bounds so Track2D can crop to them before inference
+        """
+        with open(path, "w") as f:
+            json.dump({"resolution": [self.width, self.height], "rois": self.rois()}, f, indent=2)
+        print(f"Regions of interest saved to {path}")
+
     def get_threshold(self):
         thres = self.threshold["Heightwise"]
         return thres if thres is not None else 0
@@ -73,6 +88,7 @@ def get_projection_matrix(cap, i: int = 0) -> None:
     object_points[:, :2] = np.mgrid[0:7, 0:7].T.reshape(-1, 2)
     object_points = object_points * square_size
     last = time.time()
+    size = None
 
     while cv2.waitKey(50) != 27 and len(obj_points) < 49:
         img = cap()[i]
@@ -83,19 +99,27 @@ def get_projection_matrix(cap, i: int = 0) -> None:
             continue
         
         gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        size = gray.shape[::-1]
 
         # Find chessboard corners
         ret, corners = cv2.findChessboardCorners(gray, (num_intersections_in_x, num_intersections_in_y), None)
 
         if ret:
+            criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+            corners = cv2.cornerSubPix(gray, corners, (5, 5), (-1, -1), criteria)
             obj_points.append(object_points)
             img_points.append(corners)
+            # Wait before the next view, so the board can be moved rather than captured again in the same place
+            last = time.time()
 
-            # Draw and display the corners
-            cv2.drawChessboardCorners(img, (7, 7), corners, ret)
-            cv2.imshow('SUCCESS!', img)
+            # Draw and display the corners, on a copy as the capture may still be using the frame
+            shown = img.copy()
+            cv2.drawChessboardCorners(shown, (7, 7), corners, ret)
+            cv2.imshow('SUCCESS!', shown)
 
-    ret, K, dist, rvecs, tvecs = cv2.calibrateCamera(obj_points, img_points, (640, 640), None, None)
+    if len(obj_points) < 3:
+        raise ValueError(f"Found the chessboard in only {len(obj_points)} views of camera {i}")
+    ret, K, dist, rvecs, tvecs = cv2.calibrateCamera(obj_points, img_points, size, None, None)
 
     return ret, K, dist, rvecs, tvecs
 
@@ -1,8 +0,0 @@
-from typing import Dict, Tuple
-
-type XYTrack = Tuple[float, float]
-type XYTracks = Dict[int, XYTrack]
-
-type XYZTrack = Tuple[float, float, float]
-type XYZTracks = Dict[int, XYZTrack]
-type IDPair = Tuple[int, int]
\ No newline at end of file
@@ -0,0 +1,149 @@
+###
+# Headless intrinsic calibration of every camera from chessboard frames, searched across a process pool
+# Usage: python intrinsics.py --recording DIR | --folders CAMERA0_DIR CAMERA1_DIR ... [--views 40] [--output intrinsics.json]
+###
+
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Tuple
+import cv2
+import numpy as np
+from recording import ReplayResults
+
+# Inner corners of the chessboard and the size of a square in metres, as in calibration.get_projection_matrix
+BOARD = (7, 7)
+SQUARE_SIZE = 0.035
+IMAGE_TYPES = (".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff")
+
+# Written here and read by calibrate.py, apart from the camera parameters the server reloads,
+# so new intrinsics never sit beside projections and F computed with the old ones
+INTRINSICS = "intrinsics.json"
+
+# A frame is a path to an image, or a (recording directory, camera, index) of a FrameRecorder recording
+type FrameSource = str | Tuple[str, int, int]
+
+@lru_cache(maxsize=4)
+def open_recording(directory: str) -> ReplayResults:
+    # Each worker maps a recording once and reuses it for every frame it is given
+    return ReplayResults(directory, speed=None)
+
+def load_frame(source: FrameSource) -> np.ndarray:
+    if isinstance(source, str):
+        return cv2.imread(source)
+    directory, camera, index = source
+    return np.asarray(open_recording(directory).streams[camera][index])
+
+def find_corners(source: FrameSource) -> np.ndarray | None:
+    """
+    Chessboard corners in a frame refined to sub-pixel accuracy, None if the whole board is not visible
+    """
+    image = load_frame(source)
+    if image is None:
+        return None
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    flags = cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE | cv2.CALIB_CB_FAST_CHECK
+    found, corners = cv2.findChessboardCorners(gray, BOARD, flags=flags)
+    if not found:
+        return None
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+    return cv2.cornerSubPix(gray, corners, (5, 5), (-1, -1), criteria)
+
+def folder_sources(folder: str) -> List[FrameSource]:
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(IMAGE_TYPES))
+
+def recording_sources(directory: str, search: int) -> List[List[FrameSource]]:
+    """
+    Up to `search` frames spread evenly across a recording, for each camera
+    """
+    replay = open_recording(directory)
+    indices = np.unique(np.linspace(0, replay.count - 1, min(search, replay.count)).astype(int)).tolist() if replay.count else []
+    return [[(directory, camera, index) for index in indices] for camera in range(replay.cameras)]
+
+def spread_views(detections: List[np.ndarray], size: Tuple[int, int], views: int) -> List[int]:
+    """
+    Picks the views that differ most in where the board is, how big it is and how it is tilted,
+    so a few dozen views constrain the lens as well as hundreds of near-duplicates would
+
+    Returns:
+        List[int]: Indices into `detections`
+    """
+    if len(detections) <= views:
+        return list(range(len(detections)))
+
+    width, height = size
+    corners = np.stack([detection.reshape(-1, 2) for detection in detections])
+    centres = corners.mean(axis=1) / (width, height)
+    spans = (corners.max(axis=1) - corners.min(axis=1)) / (width, height)
+    # Ratio of the board's first and last rows and columns, which changes as it tilts
+    grid = corners.reshape(len(corners), BOARD[1], BOARD[0], 2)
+    rows = np.linalg.norm(grid[:, 0, -1] - grid[:, 0, 0], axis=1) / np.linalg.norm(grid[:, -1, -1] - grid[:, -1, 0], axis=1)
+    columns = np.linalg.norm(grid[:, -1, 0] - grid[:, 0, 0], axis=1) / np.linalg.norm(grid[:, -1, -1] - grid[:, 0, -1], axis=1)
+    features = np.column_stack((centres, spans, np.log(rows), np.log(columns)))
+
+    # Farthest point sampling, starting from the view nearest the middle of the image
+    chosen = [int(np.argmin(np.linalg.norm(centres - 0.5, axis=1)))]
+    distances = np.linalg.norm(features - features[chosen[0]], axis=1)
+    while len(chosen) < views:
+        index = int(np.argmax(distances))
+        chosen.append(index)
+        distances = np.minimum(distances, np.linalg.norm(features - features[index], axis=1))
+    return chosen
+
+def calibrate_camera(sources: List[FrameSource], pool: ProcessPoolExecutor, views: int = 40) -> Tuple[float, np.ndarray, np.ndarray, int]:
+    """
+    Searches every frame for the chessboard in parallel, then calibrates on a well spread subset of the views found
+
+    Returns:
+        float: RMS reprojection error in pixels
+        np.ndarray: Camera matrix
+        np.ndarray: Distortion coefficients
+        int: Number of views calibrated on
+    """
+    detections = [corners for corners in pool.map(find_corners, sources, chunksize=8) if corners is not None]
+    if len(detections) < 3:
+        raise ValueError(f"Found the chessboard in only {len(detections)} of {len(sources)} frames")
+
+    height, width = load_frame(sources[0]).shape[:2]
+    subset = [detections[i] for i in spread_views(detections, (width, height), views)]
+
+    object_points = np.zeros((BOARD[0] * BOARD[1], 3), np.float32)
+    object_points[:, :2] = np.mgrid[0:BOARD[0], 0:BOARD[1]].T.reshape(-1, 2) * SQUARE_SIZE
+    rms, K, dist, _, _ = cv2.calibrateCamera([object_points] * len(subset), subset, (width, height), None, None)
+    return rms, K, dist, len(subset)
+
+def save_intrinsics(path: str, intrinsics: List[Tuple[np.ndarray, np.ndarray]]):
+    """
+    Writes K1, D1, K2, D2, ... for calibrate.py to use the next time it is run
+    """
+    params = {}
+    for camera, (K, dist) in enumerate(intrinsics):
+        params[f"K{camera + 1}"] = K.tolist()
+        params[f"D{camera + 1}"] = np.ravel(dist).tolist()
+    with open(path, "w") as f:
+        json.dump(params, f, indent=2)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate camera intrinsics from chessboard frames")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--recording", help="FrameRecorder directory with every camera")
+    source.add_argument("--folders", nargs="+", help="Directory of images per camera, in camera order")
+    parser.add_argument("--search", type=int, default=500, help="Most frames of a recording searched per camera")
+    parser.add_argument("--views", type=int, default=40, help="Views calibrated on per camera")
+    parser.add_argument("--workers", type=int, default=None, help="Processes, defaults to one per CPU")
+    parser.add_argument("--output", default=INTRINSICS)
+    args = parser.parse_args()
+
+    cameras = recording_sources(args.recording, args.search) if args.recording else [folder_sources(folder) for folder in args.folders]
+
+    intrinsics = []
+    with ProcessPoolExecutor(args.workers) as pool:
+        for camera, sources in enumerate(cameras):
+            rms, K, dist, used = calibrate_camera(sources, pool, args.views)
+            print(f"Camera {camera}: {used} views, RMS reprojection error {rms:.3f} px")
+            intrinsics.append((K, dist))
+
+    save_intrinsics(args.output, intrinsics)
+    print(f"Intrinsics saved to {args.output}, run calibrate.py to recompute the camera parameters with them")
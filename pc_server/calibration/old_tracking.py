@@ -1,5 +1,4 @@
-from calibration import CameraCalibrator
-from typing import Dict, List, Tuple
+from typing import TYPE_CHECKING, Dict, List, Tuple
 import pandas as pd
 import numpy as np
 from ultralytics.engine.results import Results
@@ -8,6 +7,10 @@ from ultralytics import YOLO
 import cv2
 from interfaces import XYTrack, XYTracks, XYZTrack, XYZTracks, IDPair
 
+# calibration imports this module, so only import it back for type checking
+if TYPE_CHECKING:
+    from calibration import CameraCalibrator
+
 class Track2D:
     def __init__(self):
         self.model = YOLO("models/led.pt")
@@ -79,7 +82,7 @@ class Track3D:
     Tracks objects in a 3D space using two cameras
     Assumes that frames sharing a common second axis are the same
     """
-    def __init__(self, calibrator: CameraCalibrator, obj_count = 100):
+    def __init__(self, calibrator: "CameraCalibrator", obj_count = 100):
         self.tracking: XYZTracks = {}
         self.idMap: Dict[int, IDPair] = {}
         self.calibrator = calibrator
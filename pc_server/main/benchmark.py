@@ -0,0 +1,149 @@
+###
+# Microbenchmarks for the per-frame hot paths
+# Run `python benchmark.py` for all of them or `python benchmark.py association` for one
+###
+
+import json
+import os
+import sys
+import tempfile
+import time
+import cv2
+import numpy as np
+from ultralytics import YOLO
+from recording import ReplayResults
+from tracking import associate, triangulate_views, Track3D
+
+def measure(fn, repeats: int) -> float:
+    """
+    Median wall time of a call in milliseconds.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)) * 1000
+
+def bench_association(counts=(5, 10, 20, 50, 100, 200), repeats=200):
+    """
+    2D track association latency against the number of objects in frame.
+    """
+    rng = np.random.default_rng(0)
+    print("objects  association (ms)")
+    for count in counts:
+        previous = rng.uniform(0, 640, (count, 2))
+        tracks = {i + 1: tuple(point) for i, point in enumerate(previous)}
+        detections = rng.permutation(previous + rng.normal(0, 3, previous.shape))
+        ms = measure(lambda: associate(tracks, detections, 1000.), repeats)
+        print(f"{count:7d}  {ms:16.3f}")
+
+def synthetic_cameras(path: str) -> np.ndarray:
+    """
+    Writes camera_params.json for a deep and a wide camera looking into a 0.4 m cube from the side and the front.
+
+    Returns:
+        np.ndarray: (2, 3, 4) projection matrices of the two cameras
+    """
+    K = np.array([[800., 0, 320], [0, 800., 320], [0, 0, 1]])
+    R, _ = cv2.Rodrigues(np.array([0, -np.pi / 2.5, 0]))
+    t = -R @ np.array([1.0, 0, 0.4])
+    P1 = K @ np.hstack((np.eye(3), np.zeros((3, 1))))
+    P2 = K @ np.hstack((R, t[:, None]))
+    skew = np.array([[0, -t[2], t[1]], [t[2], 0, -t[0]], [-t[1], t[0], 0]])
+    F = np.linalg.inv(K).T @ skew @ R @ np.linalg.inv(K)
+    with open(path, "w") as f:
+        json.dump({
+            "F": (F / np.linalg.norm(F)).tolist(),
+            "K1": K.tolist(),
+            "K2": K.tolist(),
+            "P1": P1.tolist(),
+            "P2": P2.tolist(),
+            "offsets": [-0.2, -0.2, 0.8],
+            "scales": [0.4, 0.4, 0.4]
+        }, f, indent=2)
+    return np.stack((P1, P2))
+
+def project(P: np.ndarray, points: np.ndarray) -> np.ndarray:
+    homogeneous = P @ np.vstack((points.T, np.ones(len(points))))
+    return (homogeneous[:2] / homogeneous[2]).T
+
+def bench_3d(counts=(5, 10, 20, 50, 100), obj_count=100, frames=100):
+    """
+    Track3D latency per frame against the number of objects, on synthetic cameras with jittering objects.
+    """
+    rng = np.random.default_rng(0)
+    print("objects  3D tracking (ms)")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "camera_params.json")
+        P = synthetic_cameras(path)
+        for count in counts:
+            tracker = Track3D((220, 275, 165), obj_count, path)
+            objects = rng.uniform((-0.2, -0.2, 0.8), (0.2, 0.2, 1.2), (count, 3))
+            sequence = []
+            for _ in range(frames):
+                positions = objects + rng.normal(0, 0.002, objects.shape)
+                sequence.append([
+                    {i + 1: tuple(point) for i, point in enumerate(project(P[0], positions).tolist())},
+                    {i + 1: tuple(point) for i, point in enumerate(project(P[1], positions).tolist())}
+                ])
+            frame = iter(sequence * 2)
+            # The first pass assigns IDs, later ones maintain them
+            tracker(next(frame))
+            print(f"{count:7d}  {measure(lambda: tracker(next(frame)), frames):16.3f}")
+
+def bench_triangulation(counts=(10, 100, 10000), views=(2, 3, 4, 6), repeats=50):
+    """
+    N-view triangulation latency against the number of points and cameras, each camera missing a quarter of points.
+    """
+    rng = np.random.default_rng(0)
+    K = np.array([[800., 0, 320], [0, 800., 320], [0, 0, 1]])
+    print("points  cameras  triangulation (ms)")
+    for count in counts:
+        points = rng.uniform((-0.2, -0.2, 0.8), (0.2, 0.2, 1.2), (count, 3))
+        for cameras in views:
+            P = []
+            for camera in range(cameras):
+                R, _ = cv2.Rodrigues(np.array([0, 2 * np.pi * camera / cameras, 0]))
+                P.append(K @ np.hstack((R, (-R @ np.array([0, 0, 1.]) + np.array([0, 0, 1.]))[:, None])))
+            P = np.stack(P)
+            pixels = np.stack([project(camera, points) for camera in P], axis=1)
+            seen = rng.random((count, cameras)) > 0.25
+            seen[:, :2] = True
+            ms = measure(lambda: triangulate_views(P, pixels, seen), repeats)
+            print(f"{count:6d}  {cameras:7d}  {ms:18.3f}")
+
+def bench_inference(models=("models/led.pt", "models/led.onnx", "models/led_int8.onnx", "models/led_openvino_model"),
+                    recording: str = None, cameras=2, imgsz=640, repeats=50):
+    """
+    CPU detector latency per batch of camera frames for PyTorch and each exported runtime.
+    Frames come from a FrameRecorder recording when given, otherwise random noise.
+    """
+    if recording is not None:
+        replay = ReplayResults(recording, speed=None)
+        frames = replay()
+    else:
+        rng = np.random.default_rng(0)
+        frames = [rng.integers(0, 255, (imgsz, imgsz, 3), dtype=np.uint8) for _ in range(cameras)]
+
+    print("model                          batch latency (ms)")
+    for path in models:
+        if not os.path.exists(path):
+            print(f"{path:30s} missing, export it with inference.py")
+            continue
+        model = YOLO(path, task="detect")
+        infer = lambda: model(frames, imgsz=imgsz, device="cpu", verbose=False)
+        # Warm up so lazy initialisation is not measured
+        infer()
+        print(f"{path:30s} {measure(infer, repeats):20.1f}")
+
+BENCHMARKS = {
+    "association": bench_association,
+    "3d": bench_3d,
+    "triangulation": bench_triangulation,
+    "inference": bench_inference,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or BENCHMARKS:
+        BENCHMARKS[name]()
\ No newline at end of file
@@ -0,0 +1,190 @@
+###
+# Camera calibration parsed and checked once, and reloaded into running trackers whenever the file changes
+###
+
+import json
+import os
+import threading
+import traceback
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+
+# Distortion coefficient counts OpenCV accepts
+DISTORTION_LENGTHS = (4, 5, 8, 12, 14)
+
+def fundamental_from_projections(P1: np.ndarray, P2: np.ndarray) -> np.ndarray:
+    """
+    Fundamental matrix between two calibrated cameras, with pts2_h.T @ F @ pts1_h = 0 for true correspondences
+    """
+    # The first camera's centre is the null space of its projection matrix
+    centre = np.linalg.svd(P1)[2][-1]
+    epipole = P2 @ centre
+    skew = np.array([
+        [0, -epipole[2], epipole[1]],
+        [epipole[2], 0, -epipole[0]],
+        [-epipole[1], epipole[0], 0]
+    ])
+    return skew @ P2 @ np.linalg.pinv(P1)
+
+def matrix(params: dict, key: str, shape: Tuple[int, ...]) -> np.ndarray:
+    """
+    Reads an entry as a float array of the given shape, raising ValueError if it is anything else
+    """
+    try:
+        value = np.array(params[key], dtype=np.float64)
+    except KeyError:
+        raise ValueError(f"Missing {key}")
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} is not numeric")
+    if value.shape != shape:
+        raise ValueError(f"{key} has shape {value.shape}, expected {shape}")
+    if not np.isfinite(value).all():
+        raise ValueError(f"{key} is not finite")
+    return value
+
+class CameraParams:
+    """
+    A validated camera calibration with everything derived from it precomputed
+    Never modified once loaded, so trackers can share it across threads and swap it out in one assignment
+
+    Either P1, P2 and F for two cameras or a list P with an entry per camera,
+    along with K1, K2, ... and optionally D1, D2, ... or lists K and D, and the tank's offsets and scales
+    """
+    __slots__ = ("path", "modified", "cameras", "P", "K", "dist", "F", "offsets", "scales")
+
+    def __init__(self, params: dict, path: str = None, modified: int = None):
+        self.path = path
+        self.modified = modified
+        try:
+            self._parse(params)
+        except (TypeError, KeyError, IndexError, AttributeError) as e:
+            # Entries of the wrong kind, such as a number where a list belongs
+            raise ValueError(f"Malformed calibration: {e!r}") from e
+
+    def _parse(self, params: dict):
+        if "P" in params:
+            if not isinstance(params["P"], list) or len(params["P"]) < 2:
+                raise ValueError("P must list at least two cameras")
+            self.P = matrix(params, "P", (len(params["P"]), 3, 4))
+        else:
+            self.P = np.stack([matrix(params, key, (3, 4)) for key in ("P1", "P2")])
+        self.cameras = len(self.P)
+
+        if "K" in params:
+            self.K = list(matrix(params, "K", (self.cameras, 3, 3)))
+        else:
+            self.K = [matrix(params, f"K{camera + 1}", (3, 3)) for camera in range(self.cameras)]
+        for camera, K in enumerate(self.K):
+            if K[0, 0] <= 0 or K[1, 1] <= 0:
+                raise ValueError(f"Camera {camera} has a non-positive focal length")
+
+        # Lens distortion, absent from calibrations made before it was measured
+        dist = params["D"] if "D" in params else [params.get(f"D{camera + 1}") for camera in range(self.cameras)]
+        if len(dist) != self.cameras:
+            raise ValueError(f"D has {len(dist)} entries for {self.cameras} cameras")
+        self.dist: List[np.ndarray | None] = []
+        for camera, D in enumerate(dist):
+            if D is None:
+                self.dist.append(None)
+                continue
+            D = np.ravel(np.array(D, dtype=np.float64))
+            if len(D) not in DISTORTION_LENGTHS or not np.isfinite(D).all():
+                raise ValueError(f"Camera {camera} has invalid distortion coefficients")
+            self.dist.append(D)
+
+        self.offsets = matrix(params, "offsets", (3,))
+        self.scales = matrix(params, "scales", (3,))
+        if (self.scales == 0).any():
+            raise ValueError("scales must be non-zero")
+
+        # (i, j): fundamental matrix from camera i to camera j, for every i < j
+        self.F: Dict[Tuple[int, int], np.ndarray] = {
+            (i, j): fundamental_from_projections(self.P[i], self.P[j])
+            for i in range(self.cameras) for j in range(i + 1, self.cameras)
+        }
+        # A two camera calibration's own fundamental matrix is the one it was measured as
+        if "F" in params and self.cameras == 2:
+            self.F[0, 1] = matrix(params, "F", (3, 3))
+        for pair, F in self.F.items():
+            if np.linalg.norm(F) < 1e-12:
+                raise ValueError(f"Cameras {pair} share a centre, so have no epipolar geometry")
+
+    @classmethod
+    def load(cls, path: str) -> "CameraParams":
+        """
+        Reads and validates a calibration file, raising ValueError if it is unusable
+        """
+        modified = os.stat(path).st_mtime_ns
+        with open(path) as f:
+            try:
+                params = json.load(f)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"{path} is not valid JSON: {e}")
+        if not isinstance(params, dict):
+            raise ValueError(f"{path} does not hold an object")
+        return cls(params, path, modified)
+
+class CalibrationStore(threading.Thread):
+    """
+    Holds the current calibration and polls its file, handing each valid new version to subscribers
+    A file that fails to parse or validate, for example one caught half written, is reported and ignored,
+    so trackers keep running on the last good calibration
+
+    Args:
+        path (str): Calibration file
+        interval (float): Seconds between checks of the file
+    """
+    def __init__(self, path: str = "camera_params.json", interval: float = 1.0):
+        super().__init__(name="calibration", daemon=True)
+        self.path = path
+        self.interval = interval
+        self.params = CameraParams.load(path)
+        self.modified = self.params.modified
+        self.subscribers: List[Callable[[CameraParams], None]] = []
+        self.stop_event = threading.Event()
+        self.reloads = 0
+
+    def subscribe(self, callback: Callable[[CameraParams], None]):
+        self.subscribers.append(callback)
+
+    def check(self) -> bool:
+        """
+        Reloads the calibration if its file has changed
+
+        Returns:
+            bool: Whether a new calibration was handed out
+        """
+        try:
+            modified = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if modified == self.modified:
+            return False
+        # Only retry a bad file once it changes again
+        self.modified = modified
+
+        try:
+            params = CameraParams.load(self.path)
+        except (OSError, ValueError) as e:
+            print(f"Ignoring calibration change: {e}")
+            return False
+
+        self.params = params
+        self.reloads += 1
+        print(f"Calibration reloaded from {self.path}")
+        for callback in self.subscribers:
+            # One failing subscriber must not keep the calibration from the others or stop the polling
+            try:
+                callback(params)
+            except Exception:
+                print(f"Calibration subscriber {callback!r} failed:")
+                traceback.print_exc()
+        return True
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            self.check()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join(timeout=self.interval + 1)
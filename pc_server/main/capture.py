@@ -1,18 +1,29 @@
+import multiprocessing
 import threading
+import time
+from typing import List
 import cv2
-    
+from ring_buffer import FrameRingBuffer
+from sync import FrameSynchroniser
+
+# Address schemes handled by zmq_capture rather than GStreamer or file capture
+ZMQ_SCHEMES = ("tcp://", "ipc://", "inproc://", "pgm://", "epgm://")
+
 class StreamTracker(threading.Thread):
     """
-    Uses GStreamer to read a video stream from a UDP port, storing only the latest frame.
+    Uses GStreamer to read a video stream from a UDP port, decoding straight into a shared ring buffer.
     """
-    def __init__(self, port):
+    def __init__(self, port, ring: FrameRingBuffer, new_frame: threading.Condition, stop_event: threading.Event = None):
         super().__init__()
         self.cap = cv2.VideoCapture()
         self.port = port
-        self._stop_event = threading.Event()
-        self.latest_data = None
-        
-    def run(self):
+        self.ring = ring
+        self.new_frame = new_frame
+        # Seconds between frames when reading faster than real time is possible
+        self.interval = 0.
+        self._stop_event = stop_event if stop_event is not None else threading.Event()
+
+    def open(self) -> bool:
         pipeline = (
             # Uncomment to use H.264
             f'udpsrc port={self.port} caps="application/x-rtp, encoding-name=H264, payload=96" ! rtph264depay ! avdec_h264 ! videoconvert ! appsink'
@@ -21,34 +32,199 @@ class StreamTracker(threading.Thread):
             # "rtpjpegdepay ! jpegdec ! videoconvert ! queue ! appsink"
             )
 
-        if not self.cap.open(pipeline, cv2.CAP_GSTREAMER):
+        return self.cap.open(pipeline, cv2.CAP_GSTREAMER)
+
+    def run(self):
+        if not self.open():
             print("Error opening video stream or file")
             return
-        
+
+        height, width = self.ring.shape[:2]
+        next_frame = time.time()
         while not self._stop_event.is_set():
-            ret, frame = self.cap.read()
-            if ret:
-                self.latest_data = frame
+            slot = self.ring.slot_for_write()
+            ret, frame = self.cap.read(slot)
+            if not ret:
+                if self.end_of_stream():
+                    continue
+                break
+            # OpenCV only decodes in place when the frame already has the slot's shape
+            if frame is not slot:
+                cv2.resize(frame, (width, height), dst=slot)
+
+            if self.interval:
+                next_frame += self.interval
+                time.sleep(max(0., next_frame - time.time()))
+            # Arrival time at the appsink, the closest to capture time available here
+            timestamp = time.time()
+            with self.new_frame:
+                self.ring.commit(timestamp)
+                self.new_frame.notify_all()
+
+    def end_of_stream(self) -> bool:
+        """
+        Called when a read fails, returns whether to keep reading
+        A live stream only stalls, so wait briefly rather than spinning on failed reads
+        """
+        time.sleep(0.01)
+        return True
 
     def stop(self):
         self._stop_event.set()
         self.cap.release()
         cv2.destroyAllWindows()
-    
+
+class FileTracker(StreamTracker):
+    """
+    Reads a video file or device as though it were a live camera, paced to its frame rate.
+    At the end of the file it starts again from the first frame when looping, otherwise it stops.
+    """
+    def __init__(self, path: str, ring: FrameRingBuffer, new_frame: threading.Condition, stop_event: threading.Event = None,
+                 loop=False):
+        super().__init__(None, ring, new_frame, stop_event)
+        self.path = path
+        self.loop = loop
+
+    def open(self) -> bool:
+        if not self.cap.open(self.path):
+            return False
+        fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.interval = 1 / fps if fps > 0 else 0.
+        return True
+
+    def end_of_stream(self) -> bool:
+        if self.loop and self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0):
+            print(f"{self.path} ended, rewinding")
+            return True
+        print(f"{self.path} ended, stopping its capture")
+        return False
+
+def create_tracker(source, ring: FrameRingBuffer, new_frame, stop_event=None, loop=False) -> threading.Thread:
+    """
+    Picks the capture for a camera source.
+
+    Args:
+        source (int | str): A GStreamer UDP port, a ZMQ address or a video file path
+        ring (FrameRingBuffer): Where decoded frames are published
+        new_frame: Condition notified after each frame is published
+        stop_event: Event that ends the capture loop
+        loop (bool): Rewind video files when they end rather than stopping
+    """
+    if isinstance(source, int):
+        return StreamTracker(source, ring, new_frame, stop_event)
+    if source.startswith(ZMQ_SCHEMES):
+        # Only import ZMQ when a ZMQ camera is configured
+        from zmq_capture import StreamTracker as ZMQStreamTracker
+        return ZMQStreamTracker(source, ring, new_frame, stop_event)
+    return FileTracker(source, ring, new_frame, stop_event, loop)
+
+class StreamProcess(multiprocessing.Process):
+    """
+    Runs a capture in its own interpreter so decoding never competes with inference for the GIL.
+    """
+    def __init__(self, source, ring: FrameRingBuffer, new_frame, loop=False):
+        super().__init__(daemon=True)
+        self.source = source
+        self.loop = loop
+        self.spec = ring.spec
+        self.new_frame = new_frame
+        self._stop_event = multiprocessing.Event()
+
+    def run(self):
+        ring = FrameRingBuffer(*self.spec)
+        tracker = create_tracker(self.source, ring, self.new_frame, self._stop_event, self.loop)
+        try:
+            tracker.run()
+        finally:
+            tracker.stop()
+            ring.close()
+
+    def stop(self):
+        self._stop_event.set()
+        self.join(timeout=1)
+        # Blocked reads never see the stop event
+        if self.is_alive():
+            self.terminate()
+
 class LatestResults:
     """
-    Accumulates the latest results from multiple streams.
+    Accumulates the latest results from any number of streams.
+    Each call waits on a shared condition that captures notify, so callers never need to poll.
+    When synchronised, each call blocks until a new set of frames captured within `tolerance` seconds exists.
+    With `processes`, each stream is decoded in a separate process and handed over through shared memory.
+
+    Args:
+        sources (List[int | str]): One per camera, a GStreamer UDP port, a ZMQ address or a video file
+        resolution (Tuple[int, int]): Width and height every frame is delivered at
+        reader_buffers (int): How many reads a returned frame stays valid for
+        loop_files (bool): Rewind video files when they end, otherwise capture is finished once any file ends
     """
-    def __init__(self):
-        self.pollers = [StreamTracker(5000 + i) for i in range(2)]
+    def __init__(self, sources: List[int | str] = (5000, 5001), resolution=(640, 640), synchronise=False, tolerance=0.02, timeout=1.0,
+                 processes=False, slots=4, reader_buffers=2, loop_files=False):
+        width, height = resolution
+        self.sources = list(sources)
+        self.rings = [FrameRingBuffer((height, width, 3), slots=slots, reader_buffers=reader_buffers) for _ in self.sources]
+        if processes:
+            self.new_frame = multiprocessing.Condition()
+            self.pollers = [StreamProcess(source, ring, self.new_frame, loop_files) for source, ring in zip(self.sources, self.rings)]
+        else:
+            self.new_frame = threading.Condition()
+            self.pollers = [create_tracker(source, ring, self.new_frame, loop=loop_files) for source, ring in zip(self.sources, self.rings)]
+        self.synchroniser = FrameSynchroniser(self.rings, self.new_frame, tolerance, timeout) if synchronise else None
+        self.timeout = timeout
+        # Last frame handed out per camera, so unchanged cameras are not copied again
+        self.images = [None for _ in self.sources]
+        self.sequences = [0 for _ in self.sources]
+        self.timestamps = [0. for _ in self.sources]
+        self.started = False
 
     def start(self):
         for poller in self.pollers:
             poller.start()
+        self.started = True
+
+    @property
+    def finished(self) -> bool:
+        """
+        Whether a video file has ended without looping, live streams never run out
+        """
+        return self.started and any(
+            not poller.is_alive()
+            for source, poller in zip(self.sources, self.pollers)
+            if isinstance(source, str) and not source.startswith(ZMQ_SCHEMES)
+        )
+
+    def has_new_frame(self) -> bool:
+        return any(ring.latest != sequence for ring, sequence in zip(self.rings, self.sequences))
 
     def __call__(self):
-        return [poller.latest_data for poller in self.pollers]
-    
+        """
+        Blocks until a new frame (or synchronised set when synchronising) arrives or the timeout expires.
+        Compare `sequences` between calls to tell whether anything changed.
+        """
+        if self.synchroniser is None:
+            with self.new_frame:
+                self.new_frame.wait_for(self.has_new_frame, self.timeout)
+            for i, ring in enumerate(self.rings):
+                sequence = ring.latest
+                if sequence != self.sequences[i]:
+                    frame = ring.read(sequence)
+                    if frame is not None:
+                        self.images[i], self.sequences[i], self.timestamps[i] = frame.image, frame.sequence, frame.timestamp
+            return list(self.images)
+
+        frames = self.synchroniser()
+        if frames is None:
+            return [None for _ in self.rings]
+        self.images = [frame.image for frame in frames]
+        self.sequences = [frame.sequence for frame in frames]
+        self.timestamps = [frame.timestamp for frame in frames]
+        return list(self.images)
+
     def stop(self):
         for poller in self.pollers:
-            poller.stop()    
\ No newline at end of file
+            poller.stop()
+        for poller in self.pollers:
+            poller.join(timeout=1)
+        for ring in self.rings:
+            ring.close()
\ No newline at end of file
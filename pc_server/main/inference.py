@@ -0,0 +1,141 @@
+###
+# Export the detector for CPU inference, optionally quantised to INT8 on our own recorded frames
+# Usage: python inference.py onnx|openvino [--int8 --recording DIR] [--imgsz 640] [--batch 2]
+###
+
+import argparse
+import os
+import tempfile
+from typing import Iterator
+import cv2
+import numpy as np
+from ultralytics import YOLO
+from recording import ReplayResults
+
+def calibration_frames(recording: str, count: int = 300) -> Iterator[np.ndarray]:
+    """
+    Yields up to `count` frames spread evenly across a FrameRecorder recording, every camera included.
+    """
+    replay = ReplayResults(recording, speed=None)
+    step = max(1, replay.count * replay.cameras // count)
+    for index in range(0, replay.count * replay.cameras, step):
+        yield replay.streams[index % replay.cameras][index // replay.cameras]
+
+def letterbox(image: np.ndarray, imgsz: int) -> np.ndarray:
+    """
+    Matches Ultralytics' preprocessing: aspect-preserving resize, grey padding, RGB, CHW, 0-1 floats.
+    """
+    height, width = image.shape[:2]
+    scale = min(imgsz / height, imgsz / width)
+    resized = cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=cv2.INTER_LINEAR)
+    padded = np.full((imgsz, imgsz, 3), 114, dtype=np.uint8)
+    top = (imgsz - resized.shape[0]) // 2
+    left = (imgsz - resized.shape[1]) // 2
+    padded[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return padded[:, :, ::-1].transpose(2, 0, 1).astype(np.float32) / 255
+
+def quantise_onnx(model_path: str, recording: str, imgsz: int, batch: int, count: int = 300) -> str:
+    """
+    Static INT8 post-training quantisation of an exported ONNX model, calibrated on recorded frames.
+
+    Returns:
+        str: Path of the quantised model
+    """
+    import onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    class RecordingReader(CalibrationDataReader):
+        def __init__(self):
+            self.input_name = onnx.load(model_path).graph.input[0].name
+            self.frames = calibration_frames(recording, count)
+
+        def get_next(self):
+            images = [letterbox(frame, imgsz) for _, frame in zip(range(batch), self.frames)]
+            if len(images) < batch:
+                return None
+            return {self.input_name: np.stack(images)}
+
+    output_path = model_path.replace(".onnx", "_int8.onnx")
+    quantize_static(
+        model_path,
+        output_path,
+        RecordingReader(),
+        quant_format=QuantFormat.QDQ,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        per_channel=True,
+    )
+
+    # Ultralytics reads class names, stride and input size from the model metadata
+    original = onnx.load(model_path)
+    quantised = onnx.load(output_path)
+    del quantised.metadata_props[:]
+    quantised.metadata_props.extend(original.metadata_props)
+    onnx.save(quantised, output_path)
+
+    return output_path
+
+def calibration_dataset(recording: str, names, directory: str, count: int = 300) -> str:
+    """
+    Writes recorded frames out as an unlabelled dataset for Ultralytics' INT8 calibration.
+
+    Returns:
+        str: Path of the dataset YAML
+    """
+    images = os.path.join(directory, "images")
+    os.makedirs(images, exist_ok=True)
+    for i, frame in enumerate(calibration_frames(recording, count)):
+        cv2.imwrite(os.path.join(images, f"{i:05d}.jpg"), frame)
+
+    yaml_path = os.path.join(directory, "calibration.yaml")
+    with open(yaml_path, "w") as f:
+        f.write(f"path: {directory}\ntrain: images\nval: images\nnames:\n")
+        for key, name in names.items():
+            f.write(f"  {key}: {name}\n")
+    return yaml_path
+
+def export_model(weights: str = "models/led.pt", backend: str = "onnx", imgsz: int = 640, batch: int = 2,
+                 int8: bool = False, recording: str = None) -> str:
+    """
+    Exports the PyTorch detector for a CPU runtime with a fixed input shape.
+    Track2D loads the result like any other model, picking the runtime from the file type.
+
+    Args:
+        weights (str): PyTorch weights to export
+        backend (str): "onnx" for ONNX Runtime or "openvino" for OpenVINO
+        imgsz (int): Fixed square input size
+        batch (int): Fixed batch size, the number of cameras times the number of tiles per camera, and Track2D's `batch`
+        int8 (bool): Quantise to INT8, calibrated on `recording`
+        recording (str): FrameRecorder directory of representative frames
+
+    Returns:
+        str: Path of the exported model
+    """
+    if int8 and recording is None:
+        raise ValueError("INT8 quantisation needs a recording to calibrate on")
+
+    model = YOLO(weights)
+    if backend == "onnx":
+        path = model.export(format="onnx", imgsz=imgsz, batch=batch, dynamic=False, simplify=True)
+        return quantise_onnx(path, recording, imgsz, batch) if int8 else path
+
+    if backend == "openvino":
+        if not int8:
+            return model.export(format="openvino", imgsz=imgsz, batch=batch, dynamic=False)
+        with tempfile.TemporaryDirectory() as directory:
+            data = calibration_dataset(recording, model.names, directory)
+            return model.export(format="openvino", imgsz=imgsz, batch=batch, dynamic=False, int8=True, data=data)
+
+    raise ValueError(f"Unknown inference backend {backend}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the detector for CPU inference")
+    parser.add_argument("backend", choices=["onnx", "openvino"])
+    parser.add_argument("--weights", default="models/led.pt")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--batch", type=int, default=2, help="Images per call: cameras, times tiles per camera when tiling")
+    parser.add_argument("--int8", action="store_true")
+    parser.add_argument("--recording", help="FrameRecorder directory to calibrate INT8 on")
+    args = parser.parse_args()
+
+    print(export_model(args.weights, args.backend, args.imgsz, args.batch, args.int8, args.recording))
\ No newline at end of file
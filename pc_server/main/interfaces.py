@@ -1,8 +1,47 @@
-from typing import Dict, Tuple
+from typing import Dict, Iterator, NamedTuple, Tuple
+import numpy as np
 
 type XYTrack = Tuple[float, float]
 type XYTracks = Dict[int, XYTrack]
 
 type XYZTrack = Tuple[float, float, float]
 type XYZTracks = Dict[int, XYZTrack]
-type IDPair = Tuple[int, int]
\ No newline at end of file
+type IDPair = Tuple[int, int]
+# 2D ID of one object in each camera
+type IDGroup = Tuple[int, ...]
+
+class Frame(NamedTuple):
+    """
+    A single frame from a camera, tagged with when it arrived and its position in the stream
+    """
+    sequence: int
+    timestamp: float
+    image: np.ndarray
+
+
+class Points3D:
+    """
+    3D positions of tracked objects in one frame, row i of each array belongs to ID `ids[i]`
+    Velocity and acceleration are per second, and `measured` is False for positions predicted
+    while a camera has lost the object. `error` is the RMS reprojection error in pixels, NaN when predicted
+    """
+    __slots__ = ("ids", "xyz", "velocity", "acceleration", "measured", "error")
+
+    def __init__(self, ids: np.ndarray, xyz: np.ndarray, velocity: np.ndarray = None, acceleration: np.ndarray = None,
+                 measured: np.ndarray = None, error: np.ndarray = None):
+        self.ids = ids
+        self.xyz = xyz
+        self.velocity = velocity if velocity is not None else np.zeros_like(xyz)
+        self.acceleration = acceleration if acceleration is not None else np.zeros_like(xyz)
+        self.measured = measured if measured is not None else np.ones(len(ids), dtype=bool)
+        self.error = error if error is not None else np.zeros(len(ids))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def empty(self) -> bool:
+        return len(self.ids) == 0
+
+    def items(self) -> Iterator[Tuple[int, XYZTrack]]:
+        return zip(self.ids.tolist(), map(tuple, self.xyz.tolist()))
@@ -1,7 +1,9 @@
-# from zmq_capture import LatestResults
 from capture import LatestResults
+from recording import FrameRecorder, ReplayResults, TrackLogger
 from tracking import Track3D, Track2D
+from calibration_store import CalibrationStore
 from output import HLSEncoder, FPSCounter
+from pipeline import Stage
 import cv2
 from server import app, WebSocketServer
 import threading
@@ -11,71 +13,147 @@ RESOLUTION = (640, 640)
 # Dimensions of the tank in mm
 TANK = (220, 275, 165)
 SCALE = (TANK[0] / RESOLUTION[0], TANK[1] / RESOLUTION[0], TANK[2] / RESOLUTION[1])
+# One source per camera: a GStreamer UDP port, a ZMQ address (e.g. "tcp://192.168.0.122:5555") or a video file
+# The first two are the deep and wide views used for 3D tracking
+CAMERAS = [5000, 5001]
+# Where each camera's HLS stream is written, one per entry of CAMERAS in the same order
+HLS_DIRS = ["C:/Development/Project/var/www/html/deep",
+            "C:/Development/Project/var/www/html/wide"]
+# Frames each HLS encoder may fall behind before dropping by HLS_DROP ("oldest", "newest" or "block")
+HLS_QUEUE = 4
+HLS_DROP = "oldest"
+# x264 speed and bitrate, a key of output.X264_PRESETS or a (speed preset, kbit/s) pair, e.g. "low_power" on CPU-only rigs
+HLS_PRESET = "fast"
+# Encode each stream in its own process, handing frames over through shared memory
+HLS_PROCESSES = True
+# Encode the raw frames and send detection boxes and 2D track IDs over the websocket for the browser to draw,
+# rather than drawing them into the video. Keeps overlays out of the recorded streams and leaves the CPU to inference,
+# but only players using hls.js can line them up, so off until every client has the overlay canvas
+CLIENT_OVERLAYS = False
+# Detector and where it runs. On machines without a GPU, export with `python inference.py onnx --int8 --recording DIR`
+# and use e.g. MODEL = "models/led_int8.onnx", DEVICE = "cpu"
+MODEL = "models/led.pt"
+DEVICE = 0
+IMGSZ = 640
+# Images per inference call an exported model was fixed to with inference.py's --batch, None for PyTorch models
+BATCH = None
+# Camera calibration saved by calibrate.py, reloaded into the running tracker whenever it is saved again
+CAMERA_PARAMS = "camera_params.json"
+# Tank bounds per camera saved by calibrate.py, inference only sees inside them
+ROIS = "rois.json"
+# (columns, rows) of overlapping tiles per region for high resolution cameras, e.g. (2, 2) for 2048x2048 streams
+# Each detection pass infers cameras x columns x rows crops. An exported model takes them BATCH at a time,
+# so export with --batch equal to that product to keep it to one call per frame
+TILES = None
+# Run detection every N frames, predicting positions in between unless they drift by more than MAX_UNCERTAINTY px
+DETECT_EVERY = 1
+MAX_UNCERTAINTY = 15.
+# Detections needed before a 2D track is reported, and missed detections it coasts through before deletion
+MIN_HITS = 2
+MAX_AGE = 10
+# Grey level change within a camera's bounds that counts as movement, inference is skipped on static cameras
+# None runs inference on every frame, e.g. 12. skips cameras whose view is unchanged
+MOTION_THRESHOLD = None
+# Frames each camera keeps valid after reading, covering every pipeline stage that may still hold one
+READER_BUFFERS = 6
+# Set to record the raw synchronised streams for later replay
+RECORD_DIR = None
+# Set to log every frame's 2D tracks, to triangulate again offline with offline.py, e.g. "tracks.bin" or "tracks.csv"
+TRACK_LOG = None
+# Set to replay a recording instead of using the cameras, REPLAY_SPEED = None replays as fast as possible
+REPLAY_DIR = None
+REPLAY_SPEED = 1.0
 
 def main():
-    # Uncomment if using 0MQ capture
-    # cap = LatestResults([
-    #     "tcp://192.168.0.122:5555",
-    #     "tcp://192.168.0.122:5556",
-    # ], RESOLUTION)
-    # Uncomment if using GStreamer capture
-    cap = LatestResults()
+    if len(HLS_DIRS) != len(CAMERAS):
+        raise ValueError(f"{len(CAMERAS)} cameras need as many HLS_DIRS, not {len(HLS_DIRS)}")
+    # Synchronised capture blocks until every camera has a new frame within 20 ms of the others
+    # Each stream decodes in its own process, handing frames over through shared memory
+    # Frames stay valid for READER_BUFFERS reads, enough for every stage that may still hold one
+    if REPLAY_DIR is not None:
+        cap = ReplayResults(REPLAY_DIR, REPLAY_SPEED)
+    else:
+        cap = LatestResults(CAMERAS, RESOLUTION, synchronise=True, tolerance=0.02, processes=True, reader_buffers=READER_BUFFERS)
+    recorder = FrameRecorder(RECORD_DIR, len(CAMERAS), RESOLUTION) if RECORD_DIR is not None else None
+    track_logger = TrackLogger(TRACK_LOG) if TRACK_LOG is not None else None
     # calibrator = CameraCalibrator(RESOLUTION)
-    tracker = Track3D(TANK, 2)
-    track2D = Track2D()
+    calibration = CalibrationStore(CAMERA_PARAMS)
+    tracker = Track3D(TANK, 2, calibration.params)
+    calibration.subscribe(tracker.set_calibration)
+    track2D = Track2D(len(CAMERAS), detect_every=DETECT_EVERY, max_uncertainty=MAX_UNCERTAINTY,
+                      min_hits=MIN_HITS, max_age=MAX_AGE, model=MODEL, device=DEVICE, imgsz=IMGSZ, batch=BATCH,
+                      rois=ROIS, tiles=TILES, motion_threshold=MOTION_THRESHOLD)
     # dataset_builder = MultiImageWriter(0, 100)
-    encoders = [HLSEncoder(RESOLUTION, dir) for dir in 
-                ["C:/Development/Project/var/www/html/deep", 
-                 "C:/Development/Project/var/www/html/wide"]]
     websockets = WebSocketServer()
-    fps = FPSCounter()
+    # Overlays are sent once their frame is encoded, labelled with its time in the stream so the player can line them up
+    send_overlay = (lambda stream_time, overlay: websockets.send_data({"overlay": {**overlay, "time": stream_time}})) if CLIENT_OVERLAYS else None
+    encoders = [HLSEncoder(RESOLUTION, dir, maxsize=HLS_QUEUE, drop=HLS_DROP, preset=HLS_PRESET, process=HLS_PROCESSES,
+                           on_encoded=send_overlay)
+                for dir in HLS_DIRS]
+    fps = FPSCounter(len(CAMERAS))
     # point_triangulation = PointTriangulation(TANK)
     # RelationalData(tracker)
 
-    cap.start()
-    for encoder in encoders:
-        encoder.start()
-    websockets.start()
-    threading.Thread(target=app.run, args=("0.0.0.0", 8080), daemon=True).start()
-
-    plots = [None, None]
-
-    print("Finished launching all servers")
-
-    while cv2.waitKey(1) != 27:
-        frames = cap()
-
-        fps.update(frames)
-
-        if not all(frame is not None for frame in frames):
-            continue
-        results, tracks_2d = track2D(frames)
-        if results is None:
-            continue
+    plots = [None for _ in CAMERAS]
+
+    def detect(packet):
+        frames, timestamp = packet
+        output = track2D(frames)
+        if output is None:
+            return None
+        results, tracks_2d = output
+        # Track2D reuses its list of tracks, later stages need this frame's
+        return frames, results, list(tracks_2d), timestamp
+
+    def annotate(packet):
+        frames, results, tracks_2d, timestamp = packet
+        if CLIENT_OVERLAYS:
+            for i, (result, video_writer) in enumerate(zip(results, encoders)):
+                # Boxes are only known on frames that were detected on, tracks on every frame
+                boxes = result.boxes.data[:, :5].tolist() if result is not None else None
+                tracks = [{"id": key, "x": x, "y": y} for key, (x, y) in tracks_2d[i].items()] if tracks_2d[i] is not None else []
+                height, width = frames[i].shape[:2]
+                # Capture frames are reused after READER_BUFFERS reads, longer than the thread encoder may hold one
+                video_writer.push_frame(frames[i] if HLS_PROCESSES else frames[i].copy(), {
+                    "camera": i,
+                    "timestamp": timestamp,
+                    "width": width,
+                    "height": height,
+                    "boxes": boxes,
+                    "tracks": tracks
+                })
+                plots[i] = frames[i]
+            return
 
         for i, (result, video_writer) in enumerate(zip(results, encoders)):
-            if result is not None:
-                plots[i] = cv2.resize(result.plot(), (640, 640))
-                if tracks_2d is not None and tracks_2d[i] is not None:
-                    for key, track in tracks_2d[i].items():
-                        cv2.putText(plots[i], f"{key}", (int(track[0]), int(track[1])), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                cv2.imshow(f"Image {i}", plots[i])
-                # if video_writer is not None:
-                video_writer.push_frame(plots[i])
-        if tracks_2d is None or tracks_2d[0] is None or tracks_2d[1] is None:
-            continue
+            # Frames without a detection pass show predicted positions on the raw frame
+            plot = cv2.resize(result.plot() if result is not None else frames[i], (640, 640))
+            if tracks_2d[i] is not None:
+                for key, track in tracks_2d[i].items():
+                    cv2.putText(plot, f"{key}", (int(track[0]), int(track[1])), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+            plots[i] = plot
+            # if video_writer is not None:
+            video_writer.push_frame(plot)
+
+    def locate(packet):
+        _, results, tracks_2d, timestamp = packet
+        if any(tracks is None for tracks in tracks_2d):
+            return
+        if track_logger is not None:
+            track_logger.log(tracks_2d)
 
         # calibrator.show([result.orig_img for result in results])
 
         # dataset_builder.offer_for_write([result.orig_img for result in results])
 
-        tracks_3d = tracker(tracks_2d)
+        tracks_3d = tracker(tracks_2d, timestamp)
 
         if tracks_3d is None or tracks_3d.empty:
-            continue
+            return
 
         # tracks_3d = point_triangulation.triangulate_points(tracks_3d)
 
+        # Velocity and acceleration are in mm/s and mm/s², on the same axes as the coordinates
         websockets.send_data({
             "scatter": [
                 {
@@ -85,17 +163,74 @@ def main():
                         "x": z,
                         "y": TANK[1] - x,
                         "z": TANK[2] - y
-                    }
-                } for i, (x, y, z)
-                in tracks_3d.iterrows()
+                    },
+                    "velocity": {"x": vz, "y": -vx, "z": -vy},
+                    "acceleration": {"x": az, "y": -ax, "z": -ay},
+                    "measured": measured
+                } for i, (x, y, z), (vx, vy, vz), (ax, ay, az), measured
+                in zip(tracks_3d.ids.tolist(), tracks_3d.xyz.tolist(), tracks_3d.velocity.tolist(),
+                       tracks_3d.acceleration.tolist(), tracks_3d.measured.tolist())
             ]
         })
+
+    # Inference takes the newest frames and annotation the newest detections, dropping any backlog,
+    # while 3D tracking sees every detection pass so IDs stay continuous.
+    # Replaying as fast as possible has no real time to keep up with, so inference sees every frame and holds replay back
+    live = REPLAY_DIR is None or REPLAY_SPEED is not None
+    annotation = Stage("annotation", annotate, latest=True)
+    localisation = Stage("3D tracking", locate, maxsize=4, latest=False)
+    inference = Stage("inference", detect, outputs=[annotation, localisation], latest=live)
+    stages = [inference, annotation, localisation]
+
+    cap.start()
+    if recorder is not None:
+        recorder.start()
+    for encoder in encoders:
+        encoder.start()
+    for stage in stages:
+        stage.start()
+    websockets.start()
+    calibration.start()
+    threading.Thread(target=app.run, args=("0.0.0.0", 8080), daemon=True).start()
+
+    print("Finished launching all servers")
+
+    # cap() sleeps until new frames arrive, waitKey only services the preview windows
+    while cv2.waitKey(1) != 27:
+        frames = cap()
+
+        new_frames = fps.update(frames, cap.sequences)
+
+        if cap.finished:
+            break
+        # Timed out without a new frame
+        if new_frames == 0 or not all(frame is not None for frame in frames):
+            continue
+        # Recording is lossless and blocks capture rather than dropping frames
+        if recorder is not None:
+            recorder.push(frames, cap.timestamps)
+        inference.put((frames, max(cap.timestamps)))
+
+        for i, plot in enumerate(plots):
+            if plot is not None:
+                cv2.imshow(f"Image {i}", plot)
     
     fps.show_fps()
+    for stage in stages:
+        stage.stop()
+        print(stage)
+    if track2D.motion is not None:
+        print(track2D.motion)
+    calibration.stop()
     cv2.destroyAllWindows()
     cap.stop()
+    if recorder is not None:
+        recorder.stop()
+    if track_logger is not None:
+        track_logger.close()
     for video_writer in encoders:
         video_writer.stop()
+        print(video_writer)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
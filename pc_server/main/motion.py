@@ -0,0 +1,196 @@
+###
+# Vectorised motion models shared by the 2D and 3D trackers, and a cheap check for motion in the image
+###
+
+from math import factorial
+from typing import Dict, Iterable, List, Tuple
+import cv2
+import numpy as np
+
+class KalmanTracks:
+    """
+    A Kalman filter per tracked ID, stored as rows of preallocated arrays and stepped together.
+    The state holds position and its first `order` derivatives in `dims` dimensions:
+    order 1 is constant velocity, order 2 is constant acceleration.
+    Only positions are measured.
+    """
+    def __init__(self, dims: int = 2, order: int = 1, process_noise: float = 1., measurement_noise: float = 1., capacity: int = 64):
+        self.dims = dims
+        self.order = order
+        self.size = dims * (order + 1)
+        self.process_noise = process_noise
+        self.R = np.eye(dims) * measurement_noise ** 2
+        self.H = np.eye(dims, self.size)
+
+        self.x = np.zeros((capacity, self.size))
+        self.P = np.zeros((capacity, self.size, self.size))
+        self.rows: Dict[int, int] = {}
+        self.free: List[int] = list(range(capacity - 1, -1, -1))
+
+    def _transition(self, dt: float) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        State transition and process noise for a step of `dt`, modelling noise on the highest derivative.
+        """
+        steps = self.order + 1
+        F = np.zeros((steps, steps))
+        for i in range(steps):
+            for j in range(i, steps):
+                F[i, j] = dt ** (j - i) / factorial(j - i)
+        G = np.array([dt ** (steps - i) / factorial(steps - i) for i in range(steps)])
+        Q = np.outer(G, G) * self.process_noise ** 2
+        identity = np.eye(self.dims)
+        return np.kron(F, identity), np.kron(Q, identity)
+
+    def _grow(self):
+        capacity = len(self.x)
+        self.x = np.concatenate((self.x, np.zeros_like(self.x)))
+        self.P = np.concatenate((self.P, np.zeros_like(self.P)))
+        self.free = list(range(2 * capacity - 1, capacity - 1, -1)) + self.free
+
+    def __contains__(self, track_id: int) -> bool:
+        return track_id in self.rows
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def ids(self) -> List[int]:
+        return list(self.rows.keys())
+
+    def add(self, track_id: int, position: Iterable[float], uncertainty: float = 10.):
+        """
+        Starts filtering a new ID at rest at `position`.
+        """
+        if not self.free:
+            self._grow()
+        row = self.free.pop()
+        self.rows[track_id] = row
+        self.x[row] = 0.
+        self.x[row, :self.dims] = position
+        self.P[row] = np.eye(self.size) * uncertainty ** 2
+        self.P[row, :self.dims, :self.dims] = self.R
+
+    def remove(self, track_id: int):
+        self.free.append(self.rows.pop(track_id))
+
+    def predict(self, dt: float = 1.):
+        """
+        Advances every ID by `dt`.
+        """
+        if not self.rows:
+            return
+        rows = np.fromiter(self.rows.values(), dtype=np.int64, count=len(self.rows))
+        F, Q = self._transition(dt)
+        self.x[rows] = self.x[rows] @ F.T
+        self.P[rows] = F @ self.P[rows] @ F.T + Q
+
+    def update(self, track_ids: List[int], positions: np.ndarray):
+        """
+        Corrects the given IDs with measured positions, all in one batch.
+        """
+        if len(track_ids) == 0:
+            return
+        rows = np.array([self.rows[track_id] for track_id in track_ids])
+        x, P = self.x[rows], self.P[rows]
+
+        residuals = np.asarray(positions, dtype=np.float64) - x[:, :self.dims]
+        S = P[:, :self.dims, :self.dims] + self.R
+        K = P[:, :, :self.dims] @ np.linalg.inv(S)
+
+        self.x[rows] = x + (K @ residuals[:, :, None])[:, :, 0]
+        self.P[rows] = P - K @ P[:, :self.dims, :]
+
+    def _select(self, track_ids: List[int] = None) -> Tuple[List[int], np.ndarray]:
+        if track_ids is None:
+            track_ids = self.ids()
+        return track_ids, np.array([self.rows[track_id] for track_id in track_ids], dtype=np.int64)
+
+    def positions(self, track_ids: List[int] = None) -> Tuple[List[int], np.ndarray]:
+        track_ids, rows = self._select(track_ids)
+        return track_ids, self.x[rows, :self.dims]
+
+    def derivative(self, n: int, track_ids: List[int] = None) -> Tuple[List[int], np.ndarray]:
+        """
+        The `n`th derivative of position, 1 for velocity and 2 for acceleration.
+        """
+        track_ids, rows = self._select(track_ids)
+        if n > self.order:
+            return track_ids, np.zeros((len(rows), self.dims))
+        return track_ids, self.x[rows, n * self.dims:(n + 1) * self.dims]
+
+    def uncertainty(self, track_ids: List[int] = None) -> Tuple[List[int], np.ndarray]:
+        """
+        Standard deviation of each ID's position estimate, combined across dimensions.
+        """
+        track_ids, rows = self._select(track_ids)
+        variances = np.trace(self.P[rows, :self.dims, :self.dims], axis1=1, axis2=2)
+        return track_ids, np.sqrt(variances)
+
+
+class MotionGate:
+    """
+    Decides per camera whether anything has moved, by differencing small blurred greyscale copies of each frame.
+    Frames are compared against the last frame that was reported as moving rather than the previous one,
+    so slow movement still adds up to a detection. After `refresh` static frames in a row a camera is
+    reported as moving anyway, so gradual lighting changes cannot hold the reference forever.
+
+    Args:
+        cameras (int): Number of cameras
+        threshold (float): Grey level change for a pixel to count as moved
+        area (float): Fraction of pixels that must move
+        scale (float): Downsampling applied before differencing
+        refresh (int): Most static frames in a row before a camera is checked again regardless, 0 to never
+    """
+    def __init__(self, cameras: int = 2, threshold: float = 12., area: float = 0.0005, scale: float = 0.125, refresh: int = 300):
+        self.threshold = threshold
+        self.area = area
+        self.scale = scale
+        self.refresh = refresh
+        self.references: List[np.ndarray | None] = [None for _ in range(cameras)]
+        self.static_run = [0 for _ in range(cameras)]
+        self.checked = [0 for _ in range(cameras)]
+        self.skipped = [0 for _ in range(cameras)]
+
+    def thumbnail(self, image: np.ndarray) -> np.ndarray:
+        small = cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        # Blurring stops compression noise from counting as movement
+        return cv2.GaussianBlur(small, (3, 3), 0)
+
+    def __call__(self, images: List[np.ndarray]) -> List[bool]:
+        """
+        Whether each camera's image has moved since its reference
+
+        Args:
+            images (List[np.ndarray]): One image per camera, already cropped to the region that matters
+        """
+        moving = []
+        for camera, image in enumerate(images):
+            thumbnail = self.thumbnail(image)
+            reference = self.references[camera]
+            self.checked[camera] += 1
+
+            if reference is None or reference.shape != thumbnail.shape or 0 < self.refresh <= self.static_run[camera]:
+                moved = True
+            else:
+                changed = cv2.absdiff(thumbnail, reference) > self.threshold
+                moved = np.count_nonzero(changed) > self.area * changed.size
+
+            if moved:
+                self.references[camera] = thumbnail
+                self.static_run[camera] = 0
+            else:
+                self.static_run[camera] += 1
+                self.skipped[camera] += 1
+            moving.append(moved)
+        return moving
+
+    def skip_rate(self) -> List[float]:
+        """
+        Fraction of frames each camera has skipped inference on
+        """
+        return [skipped / checked if checked else 0. for skipped, checked in zip(self.skipped, self.checked)]
+
+    def __str__(self):
+        rates = ", ".join(f"{rate:.1%}" for rate in self.skip_rate())
+        return f"motion gate: {sum(self.skipped)} of {sum(self.checked)} camera frames skipped ({rates})"
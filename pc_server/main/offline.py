@@ -0,0 +1,56 @@
+###
+# Triangulate a logged session of 2D tracks again in bulk, e.g. after recalibrating
+# Usage: python offline.py tracks.csv trajectories.csv [--params camera_params.json] [--chunk 10000]
+###
+
+import argparse
+import numpy as np
+from recording import TRACK_DTYPE, TRAJECTORY_DTYPE, open_columns, read_columns, write_columns
+from tracking import Track3D
+
+def triangulate_log(tracks_path: str, output_path: str, bounds=(220, 275, 165), obj_count: int = 100,
+                    params: str = "camera_params.json", chunk: int = 10000) -> int:
+    """
+    Matches, keeps 3D IDs for and triangulates every frame of a TrackLogger log,
+    writing (frame, id, x, y, z, reprojection error) rows
+
+    Args:
+        tracks_path (str): Log of (frame, camera, id, x, y) rows, binary or CSV
+        output_path (str): Where the trajectories are written, binary or CSV by extension
+        bounds (Tuple[int, int, int]): Dimensions of the tank in mm
+        obj_count (int): Most objects tracked at once
+        params (str): Camera calibration to triangulate with
+        chunk (int): Frames triangulated together
+
+    Returns:
+        int: Number of 3D points written
+    """
+    tracks = read_columns(tracks_path, TRACK_DTYPE)
+    # Logs are written in frame order, but sorting keeps merged or hand-edited logs valid
+    order = np.argsort(tracks["frame"], kind="stable")
+    tracks = tracks[order]
+
+    tracker = Track3D(bounds, obj_count, params)
+    points = np.column_stack((tracks["x"], tracks["y"]))
+    written = 0
+    with open_columns(output_path, TRAJECTORY_DTYPE) as f:
+        for frames, ids, xyz, errors in tracker.batch(tracks["frame"], tracks["camera"], tracks["id"], points, chunk):
+            records = np.zeros(len(ids), dtype=TRAJECTORY_DTYPE)
+            records["frame"] = frames
+            records["id"] = ids
+            records["x"], records["y"], records["z"] = xyz.T
+            records["error"] = errors
+            write_columns(f, records)
+            written += len(records)
+    return written
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Triangulate logged 2D tracks in bulk")
+    parser.add_argument("tracks", help="TrackLogger log of 2D tracks")
+    parser.add_argument("output", help="Trajectory file to write, .csv for CSV")
+    parser.add_argument("--params", default="camera_params.json")
+    parser.add_argument("--obj-count", type=int, default=100)
+    parser.add_argument("--chunk", type=int, default=10000, help="Frames triangulated together")
+    args = parser.parse_args()
+
+    print(f"{triangulate_log(args.tracks, args.output, obj_count=args.obj_count, params=args.params, chunk=args.chunk)} points written to {args.output}")
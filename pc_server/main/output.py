@@ -2,13 +2,17 @@
 # A collection of debugging utilities
 ###
 
+import multiprocessing
 import threading
 import numpy as np
 import cv2
-from typing import List, Tuple
+from collections import deque
+from typing import Any, Callable, Deque, List, Tuple
 from matplotlib import pyplot as plt
 import queue
 import time
+from ring_buffer import FrameRingBuffer
+from pipeline import put_bounded
 
 def show_tracks(images, track=None):
     """
@@ -136,74 +140,271 @@ class MultiImageWriter(ImageWriter):
             self.write_count = (self.write_count + 1) % self.max_writes
             self.timer = None
 
+# x264 (speed preset, bitrate in kbit/s) per rig, "default" matches x264enc's own defaults
+# Faster presets leave more CPU to inference at the cost of quality per bit
+X264_PRESETS = {
+    "quality": ("slow", 4096),
+    "default": ("medium", 2048),
+    "fast": ("veryfast", 2048),
+    "low_power": ("ultrafast", 1024),
+}
+# What push_frame does when the encoder has fallen `maxsize` frames behind
+DROP_POLICIES = ("oldest", "newest", "block")
+# Length of each HLS segment. Keyframes come every SEGMENT_SECONDS and nowhere else, as scene cuts are disabled,
+# so segment n always begins n * SEGMENT_SECONDS into the stream
+SEGMENT_SECONDS = 4
+
+def open_hls_writer(resolution, dir, preset="default", fps=20) -> cv2.VideoWriter:
+    speed, bitrate = X264_PRESETS[preset] if isinstance(preset, str) else preset
+    gst_pipeline = (
+        f'appsrc ! videoconvert ! x264enc speed-preset={speed} bitrate={bitrate} key-int-max={fps * SEGMENT_SECONDS} '
+        'option-string=scenecut=0 ! '
+        'h264parse ! mpegtsmux ! '
+        f'hlssink location={dir}/segment_%05d.ts '
+        f'playlist-location={dir}/playlist.m3u8 '
+        f'target-duration={SEGMENT_SECONDS} max-files=15 playlist-length=15'
+    )
+    return cv2.VideoWriter(
+        gst_pipeline,
+        cv2.CAP_GSTREAMER,
+        0,  # FourCC ignored when using GStreamer
+        fps,
+        resolution,
+        True
+    )
+
+class EncoderProcess(multiprocessing.Process):
+    """
+    Encodes frames from a FrameRingBuffer in its own interpreter, so x264 never competes with inference for the GIL.
+    Frames the parent overwrote before they were read are counted as dropped.
+    The sequence number and stream time of each frame encoded go back through `written` when `report` is set.
+    """
+    def __init__(self, ring: FrameRingBuffer, new_frame, resolution, dir, preset, fps, report=False):
+        super().__init__(daemon=True)
+        self.spec = ring.spec
+        self.new_frame = new_frame
+        self.writer_args = (resolution, dir, preset, fps)
+        self.fps = fps
+        self.written = multiprocessing.Queue() if report else None
+        self.stop_event = multiprocessing.Event()
+        # Sequence number of the last frame encoded or given up on, read by the parent to apply its drop policy
+        self.done = multiprocessing.Value("q", 0, lock=False)
+        self.encoded = multiprocessing.Value("q", 0, lock=False)
+        self.dropped = multiprocessing.Value("q", 0, lock=False)
+
+    def run(self):
+        ring = FrameRingBuffer(*self.spec, reader_buffers=1)
+        video_out = open_hls_writer(*self.writer_args)
+        try:
+            if not video_out.isOpened():
+                print("Error opening video stream or file")
+                return
+            while not self.stop_event.is_set():
+                with self.new_frame:
+                    self.new_frame.wait_for(lambda: ring.latest > self.done.value, 0.1)
+                latest = ring.latest
+                # Only the last `slots` frames can still be in the ring
+                first = max(self.done.value + 1, latest - ring.slots + 1)
+                self.dropped.value += first - self.done.value - 1
+                for sequence in range(first, latest + 1):
+                    frame = ring.read(sequence)
+                    if frame is None:
+                        self.dropped.value += 1
+                    else:
+                        video_out.write(frame.image)
+                        if self.written is not None:
+                            self.written.put((sequence, self.encoded.value / self.fps))
+                        self.encoded.value += 1
+                    self.done.value = sequence
+        finally:
+            video_out.release()
+            ring.close()
+            if self.written is not None:
+                # The parent stops reading first, so don't wait to flush what it will never read
+                self.written.cancel_join_thread()
+
 class HLSEncoder(threading.Thread):
     """
     Encodes video streams using GStreamer and saves them as HLS segments.
+    At most `maxsize` frames wait to be encoded, so a slow encoder drops frames rather than building up delay and memory.
+
+    Args:
+        resolution (Tuple[int, int]): Width and height of every frame pushed
+        dir (str): Directory for the playlist and segments
+        maxsize (int): Frames that may wait to be encoded
+        drop (str): When full, "oldest" discards the longest waiting frame, "newest" the frame being pushed,
+            and "block" waits for space
+        preset (str | Tuple[str, int]): Key of X264_PRESETS, or an x264 (speed preset, bitrate in kbit/s)
+        process (bool): Encode in a separate process, handing frames over through shared memory
+        fps (int): Frame rate written into the stream
+        on_encoded (Callable[[float, Any], None]): Called with the stream time in seconds and the metadata
+            of each frame pushed with metadata once it is encoded, so the metadata can be matched to the video
     """
-    def __init__(self, resolution, dir):
-        super().__init__(daemon=True)
+    def __init__(self, resolution, dir, maxsize=4, drop="oldest", preset="default", process=False, fps=20,
+                 on_encoded: Callable[[float, Any], None] = None):
+        super().__init__(name=f"HLS {dir}", daemon=True)
+        if drop not in DROP_POLICIES:
+            raise ValueError(f"drop must be one of {DROP_POLICIES}, not {drop}")
+        self.resolution = resolution
+        self.dir = dir
+        self.drop = drop
+        self.preset = preset
+        self.fps = fps
+        self.on_encoded = on_encoded
         self.stop_event = threading.Event()
-        self.frame_queue = queue.Queue()
-
-        gst_pipeline = (
-            'appsrc ! videoconvert ! x264enc ! h264parse ! mpegtsmux ! '
-            f'hlssink location={dir}/segment_%05d.ts '
-            f'playlist-location={dir}/playlist.m3u8 '
-            'target-duration=4 max-files=15 playlist-length=15'
-        )
-
-        self.video_out = cv2.VideoWriter(
-            gst_pipeline,
-            cv2.CAP_GSTREAMER,
-            0,  # FourCC ignored when using GStreamer
-            20,
-            resolution,
-            True
-        )
+        self.pushed = 0
+        self.encoded = 0
+        self.dropped = 0
+        self._put_lock = threading.Lock()
+
+        if process:
+            width, height = resolution
+            self.ring = FrameRingBuffer((height, width, 3), slots=maxsize, reader_buffers=1)
+            self.new_frame = multiprocessing.Condition()
+            self.process = EncoderProcess(self.ring, self.new_frame, resolution, dir, preset, fps, report=on_encoded is not None)
+            # (sequence, metadata) of frames written to the ring, oldest first. Only the frames still in the ring,
+            # and as many again read by the process but not yet reported, can still be encoded, so older entries
+            # fall off rather than piling up if the process dies or falls behind
+            self.metadata: Deque[Tuple[int, Any]] = deque(maxlen=2 * maxsize)
+            self.frame_queue = None
+        else:
+            self.ring = self.process = None
+            self.frame_queue = queue.Queue(maxsize=maxsize)
 
     def run(self):
-        if not self.video_out.isOpened():
-            print("Error opening video stream or file")
+        if self.process is not None:
+            self.process.start()
+            self.relay()
+            return
+
+        video_out = open_hls_writer(self.resolution, self.dir, self.preset, self.fps)
+        try:
+            if not video_out.isOpened():
+                print("Error opening video stream or file")
+                return
+            while not self.stop_event.is_set():
+                try:
+                    frame, metadata = self.frame_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+                video_out.write(frame)
+                if metadata is not None and self.on_encoded is not None:
+                    self.on_encoded(self.encoded / self.fps, metadata)
+                self.encoded += 1
+        finally:
+            video_out.release()
+
+    def relay(self):
+        """
+        Hands the metadata of each frame the encoder process writes to `on_encoded`, discarding that of dropped frames
+        """
+        if self.process.written is None:
             return
         while not self.stop_event.is_set():
             try:
-                frame = self.frame_queue.get(timeout=0.1)
-                if frame is not None:
-                    self.video_out.write(frame)
+                sequence, stream_time = self.process.written.get(timeout=0.1)
             except queue.Empty:
                 continue
-    
-    def push_frame(self, frame):
-        if not self.stop_event.is_set():
-            self.frame_queue.put(frame)
+            while self.metadata and self.metadata[0][0] < sequence:
+                self.metadata.popleft()
+            if self.metadata and self.metadata[0][0] == sequence:
+                self.on_encoded(stream_time, self.metadata.popleft()[1])
+
+    def backlog(self) -> int:
+        """
+        Frames pushed but not yet encoded
+        """
+        if self.process is not None:
+            return self.ring.latest - self.process.done.value
+        return self.frame_queue.qsize()
+
+    def push_frame(self, frame, metadata=None):
+        """
+        Queues a frame to be encoded, with optional metadata handed to `on_encoded` once it is
+        The thread encoder holds on to the frame itself, the process encoder copies it before returning
+        """
+        if frame is None or self.stop_event.is_set():
+            return
+        self.pushed += 1
+        if self.process is not None:
+            self._push_shared(frame, metadata)
+        else:
+            self._push_queue((frame, metadata))
+
+    def _push_queue(self, item):
+        self.dropped += put_bounded(self.frame_queue, item, self.drop, self._put_lock,
+                                    lambda: not self.stop_event.is_set() and self.is_alive())
+
+    def _push_shared(self, frame, metadata):
+        # Writing while every slot is waiting would overwrite the oldest, which the process counts as dropped
+        if self.drop == "newest" and self.backlog() >= self.ring.slots:
+            self.dropped += 1
+            return
+        if self.drop == "block":
+            while self.backlog() >= self.ring.slots:
+                if self.stop_event.is_set() or not self.process.is_alive():
+                    return
+                time.sleep(0.001)
+        if metadata is not None and self.on_encoded is not None:
+            # Only this thread writes, so the frame's sequence number is known before the process can report it
+            self.metadata.append((self.ring.latest + 1, metadata))
+        self.ring.write(frame, time.time())
+        with self.new_frame:
+            self.new_frame.notify_all()
 
     def stop(self):
         self.stop_event.set()
-        self.video_out.release()
+        if self.process is not None:
+            self.process.stop_event.set()
+            self.process.join(timeout=2)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.ring.close()
+        if self.is_alive():
+            self.join(timeout=2)
         cv2.destroyAllWindows()
 
+    def __str__(self):
+        encoded, dropped = self.encoded, self.dropped
+        if self.process is not None:
+            # Frames the process was lapped on, on top of those dropped here
+            encoded, dropped = self.process.encoded.value, dropped + self.process.dropped.value
+        return f"{self.name}: {self.pushed} pushed, {encoded} encoded, {dropped} dropped"
+
 class FPSCounter:
     """
-    Monitors the average frames per second (FPS) of a dual camera setup.
+    Monitors the average frames per second (FPS) per camera of a multi-camera setup.
     """
-    def __init__(self):
+    def __init__(self, cameras: int = 2):
         self.start_time = None
         self.iterations = 0
-        self.prev_frames = [None, None]
+        self.prev_frames = [None for _ in range(cameras)]
+        self.prev_sequences = [0 for _ in range(cameras)]
+
+    def update(self, frames: List[cv2.Mat], sequences: List[int]) -> int:
+        """
+        Counts new frames by their capture sequence numbers rather than comparing pixels.
 
-    def update(self, frames: List[cv2.Mat]):
+        Returns:
+            int: How many cameras delivered a new frame since the last update
+        """
+        new_frames = sum(sequence != prev for sequence, prev in zip(sequences, self.prev_sequences))
         if all(frame is None for frame in self.prev_frames) or self.start_time is None:
+            # Start counting again after a stall, so frames from before it aren't divided by a shorter time
             self.start_time = time.time()
+            self.iterations = 0
         else:
-            self.iterations += sum(not np.array_equal(plot, prev_frame) for plot, prev_frame in zip(frames, self.prev_frames))
+            self.iterations += new_frames
 
         self.prev_frames = frames
+        self.prev_sequences = list(sequences)
+        return new_frames
     
     def show_fps(self):
         if self.prev_frames[0] is None:
             return
         now = time.time()
-        fps = self.iterations / ((now - self.start_time) * 2 + 0.001)
+        fps = self.iterations / ((now - self.start_time) * len(self.prev_frames) + 0.001)
         print(f"FPS: {fps:.2f}, Resolution: {self.prev_frames[0].shape[1]}x{self.prev_frames[0].shape[0]}")
 
     def show_prev_frames(self):
@@ -0,0 +1,93 @@
+###
+# Runs each step of the per-frame work on its own thread, so the slowest step sets the frame rate rather than the sum
+###
+
+import queue
+import threading
+import traceback
+from typing import Callable, List
+
+def put_bounded(items: queue.Queue, item, drop: str, lock: threading.Lock, running: Callable[[], bool]) -> int:
+    """
+    Puts `item` on a bounded queue and returns how many items were dropped to do so.
+    When the queue is full, "oldest" discards the longest waiting item, "newest" discards `item`,
+    and "block" waits for space for as long as `running` returns True, discarding `item` once it does not.
+    """
+    if drop == "block":
+        # A consumer that has stopped will never make space
+        while running():
+            try:
+                items.put(item, timeout=0.1)
+                return 0
+            except queue.Full:
+                continue
+        return 1
+
+    dropped = 0
+    # Serialise producers so evicting and inserting is one step
+    with lock:
+        while True:
+            try:
+                items.put_nowait(item)
+                return dropped
+            except queue.Full:
+                if drop == "newest":
+                    return dropped + 1
+                try:
+                    items.get_nowait()
+                    dropped += 1
+                except queue.Empty:
+                    pass
+
+class Stage(threading.Thread):
+    """
+    Applies `work` to items from a bounded queue on its own thread and passes each result to `outputs`.
+    When `latest`, a full queue discards its oldest item so the stage always works on the newest input.
+    Otherwise producers wait for space and nothing is lost.
+    Returning None from `work` passes nothing on.
+    An exception in `work` is printed and counted, and the stage carries on with the next item.
+    """
+    def __init__(self, name: str, work: Callable, outputs: List["Stage"] = (), maxsize=1, latest=True):
+        super().__init__(name=name, daemon=True)
+        self.work = work
+        self.outputs = list(outputs)
+        self.items = queue.Queue(maxsize=maxsize)
+        self.latest = latest
+        self.stop_event = threading.Event()
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+        self._put_lock = threading.Lock()
+
+    def put(self, item):
+        self.dropped += put_bounded(self.items, item, "oldest" if self.latest else "block", self._put_lock,
+                                    lambda: not self.stop_event.is_set() and self.is_alive())
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                item = self.items.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            try:
+                result = self.work(item)
+            except Exception as e:
+                self.failed += 1
+                # The full trace once, then a reminder now and then rather than one per frame
+                if self.failed == 1:
+                    print(f"{self.name} failed:")
+                    traceback.print_exc()
+                elif self.failed % 100 == 0:
+                    print(f"{self.name} has failed {self.failed} times, most recently with {e!r}")
+                continue
+            self.processed += 1
+            if result is not None:
+                for output in self.outputs:
+                    output.put(result)
+
+    def stop(self):
+        self.stop_event.set()
+        self.join(timeout=1)
+
+    def __str__(self):
+        return f"{self.name}: {self.processed} processed, {self.dropped} dropped, {self.failed} failed"
\ No newline at end of file
@@ -0,0 +1,203 @@
+###
+# Record synchronised camera streams and 2D tracks to disk, and replay them in place of live capture
+###
+
+import json
+import os
+import queue
+import threading
+import time
+from typing import IO, List
+import numpy as np
+from interfaces import XYTracks
+
+# One row per 2D track per camera per frame. Logs are flat binary files of these records,
+# or CSV files with these columns for anything with a .csv extension
+TRACK_DTYPE = np.dtype([("frame", "<i8"), ("camera", "<i8"), ("id", "<i8"), ("x", "<f8"), ("y", "<f8")])
+TRAJECTORY_DTYPE = np.dtype([("frame", "<i8"), ("id", "<i8"), ("x", "<f8"), ("y", "<f8"), ("z", "<f8"), ("error", "<f8")])
+
+def open_columns(path: str, dtype: np.dtype) -> IO:
+    """
+    Opens a columnar log for writing, with a header row if it is CSV
+    """
+    if path.endswith(".csv"):
+        f = open(path, "w")
+        f.write(",".join(dtype.names) + "\n")
+        return f
+    return open(path, "wb")
+
+def write_columns(f: IO, records: np.ndarray):
+    """
+    Appends structured records to a log opened with open_columns
+    """
+    if "b" in f.mode:
+        f.write(records.tobytes())
+    else:
+        formats = ["%d" if records.dtype[name].kind == "i" else "%.3f" for name in records.dtype.names]
+        np.savetxt(f, records, fmt=formats, delimiter=",")
+
+def read_columns(path: str, dtype: np.dtype) -> np.ndarray:
+    """
+    Reads a whole columnar log, memory-mapped when it is binary
+    """
+    if path.endswith(".csv"):
+        return np.loadtxt(path, dtype=dtype, delimiter=",", skiprows=1, ndmin=1)
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+class TrackLogger:
+    """
+    Logs every camera's 2D tracks per frame, so the session can be triangulated again offline after recalibrating
+    """
+    def __init__(self, path: str):
+        self.file = open_columns(path, TRACK_DTYPE)
+        self.frame = 0
+
+    def log(self, tracks: List[XYTracks]):
+        records = np.zeros(sum(len(camera_tracks) for camera_tracks in tracks), dtype=TRACK_DTYPE)
+        start = 0
+        for camera, camera_tracks in enumerate(tracks):
+            end = start + len(camera_tracks)
+            records["camera"][start:end] = camera
+            records["id"][start:end] = list(camera_tracks.keys())
+            records["x"][start:end] = [x for x, _ in camera_tracks.values()]
+            records["y"][start:end] = [y for _, y in camera_tracks.values()]
+            start = end
+        records["frame"] = self.frame
+        write_columns(self.file, records)
+        self.frame += 1
+
+    def close(self):
+        self.file.close()
+
+class FrameRecorder(threading.Thread):
+    """
+    Losslessly appends sets of raw frames to a directory that ReplayResults can memory-map.
+    Each camera is a flat file of frames, alongside a (frames, cameras) array of timestamps.
+    Pushing blocks once `backlog` sets are waiting, rather than dropping frames or growing without bound.
+    Sets missing a camera's frame cannot be stored and are counted in `skipped`, reported when recording stops.
+    """
+    def __init__(self, directory: str, cameras: int, resolution, backlog=64):
+        super().__init__(daemon=True)
+        width, height = resolution
+        self.directory = directory
+        self.cameras = cameras
+        self.shape = (height, width, 3)
+        self.frame_queue = queue.Queue(maxsize=backlog)
+        self.stop_event = threading.Event()
+        self.count = 0
+        self.skipped = 0
+
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, "meta.json"), "w") as f:
+            json.dump({"cameras": cameras, "shape": self.shape, "dtype": np.dtype(np.uint8).str}, f, indent=2)
+        self.frame_files = [open(os.path.join(directory, f"frames_{i}.bin"), "wb") for i in range(cameras)]
+        self.timestamp_file = open(os.path.join(directory, "timestamps.bin"), "wb")
+
+    def run(self):
+        while not self.stop_event.is_set() or not self.frame_queue.empty():
+            try:
+                frames, timestamps = self.frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            for frame, file in zip(frames, self.frame_files):
+                file.write(frame.data)
+            self.timestamp_file.write(np.asarray(timestamps, dtype=np.float64).tobytes())
+            self.count += 1
+
+        for file in self.frame_files:
+            file.close()
+        self.timestamp_file.close()
+
+    def push(self, frames: List[np.ndarray], timestamps: List[float]):
+        """
+        Queues a synchronised set of frames. Frames are copied, so capture buffers may be reused.
+        """
+        if self.stop_event.is_set():
+            return
+        if len(frames) != self.cameras:
+            raise ValueError(f"Recording {self.cameras} cameras, pushed {len(frames)} frames")
+        if any(frame is None for frame in frames):
+            self.skipped += 1
+            return
+        for frame in frames:
+            if frame.shape != self.shape:
+                raise ValueError(f"Recording frames of shape {self.shape}, pushed {frame.shape}")
+        self.frame_queue.put(([np.ascontiguousarray(frame, dtype=np.uint8).copy() for frame in frames], timestamps))
+
+    def stop(self):
+        """
+        Stops accepting frames, then waits for those already queued to reach disk.
+        """
+        self.stop_event.set()
+        self.join()
+        if self.skipped:
+            print(f"Recording {self.directory}: {self.skipped} frame sets missing a camera were not recorded")
+
+class ReplayResults:
+    """
+    Plays back a FrameRecorder directory with the same interface as capture.LatestResults.
+    Frames are memory-mapped views, so nothing is decoded or copied on playback.
+
+    Args:
+        directory (str): Directory written by FrameRecorder
+        speed (float | None): Playback rate relative to recording, None to replay as fast as possible
+        loop (bool): Start again from the first frame once the recording ends
+    """
+    def __init__(self, directory: str, speed: float | None = 1.0, loop=False):
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+        cameras = meta["cameras"]
+        shape = tuple(meta["shape"])
+        dtype = np.dtype(meta["dtype"])
+        frame_bytes = int(np.prod(shape)) * dtype.itemsize
+
+        # Frame counts come from file sizes, so recordings cut short by a crash still replay
+        paths = [os.path.join(directory, f"frames_{i}.bin") for i in range(cameras)]
+        timestamp_path = os.path.join(directory, "timestamps.bin")
+        count = min(
+            min(os.path.getsize(path) // frame_bytes for path in paths),
+            os.path.getsize(timestamp_path) // (8 * cameras)
+        )
+
+        self.streams = [np.memmap(path, dtype=dtype, mode="r", shape=(count, *shape)) for path in paths] if count else []
+        self.recorded_timestamps = np.fromfile(timestamp_path, dtype=np.float64, count=count * cameras).reshape(count, cameras)
+        self.count = count
+        self.cameras = cameras
+        self.speed = speed
+        self.loop = loop
+        self.index = 0
+        self.finished = count == 0
+        self.sequences = [0 for _ in range(cameras)]
+        self.timestamps = [0. for _ in range(cameras)]
+        self._start_time = None
+
+    def start(self):
+        self._start_time = time.time()
+
+    def __call__(self):
+        if self._start_time is None:
+            self.start()
+        if self.index >= self.count:
+            if not self.loop or self.count == 0:
+                self.finished = True
+                return [None for _ in range(self.cameras)]
+            self.index = 0
+            self._start_time = time.time()
+
+        if self.speed:
+            # Hold each set back until it is due, relative to the first frame of the recording
+            elapsed = (self.recorded_timestamps[self.index].min() - self.recorded_timestamps[0].min()) / self.speed
+            delay = self._start_time + elapsed - time.time()
+            if delay > 0:
+                time.sleep(delay)
+
+        frames = [stream[self.index] for stream in self.streams]
+        self.timestamps = self.recorded_timestamps[self.index].tolist()
+        self.index += 1
+        self.sequences = [self.index for _ in range(self.cameras)]
+        return frames
+
+    def stop(self):
+        self.streams = []
\ No newline at end of file
@@ -0,0 +1,140 @@
+###
+# Preallocated frame storage shared between a capture and the processing loop
+###
+
+from multiprocessing import shared_memory
+from typing import List, Optional, Tuple
+import numpy as np
+from interfaces import Frame
+
+class FrameRingBuffer:
+    """
+    A fixed number of frame slots in shared memory, written by a single capture thread or process.
+    Each slot carries the sequence number and timestamp of the frame in it, so readers can check
+    that a slot was not overwritten while they copied it out. Nothing is allocated per frame.
+    Create in the parent, then attach from a capture process with `FrameRingBuffer(*ring.spec)`.
+    """
+    def __init__(self, shape: Tuple[int, ...], dtype=np.uint8, slots=4, name: str = None, reader_buffers=2):
+        dtype = np.dtype(dtype)
+        frame_bytes = int(np.prod(shape)) * dtype.itemsize
+        # Write counter, then per-slot sequence numbers and timestamps
+        header_bytes = 8 * (1 + 2 * slots)
+
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=header_bytes + slots * frame_bytes)
+        self.shape = tuple(shape)
+        self.dtype = dtype
+        self.slots = slots
+
+        self._counter = np.ndarray((1,), np.int64, self.shm.buf, 0)
+        self._sequences = np.ndarray((slots,), np.int64, self.shm.buf, 8)
+        self._timestamps = np.ndarray((slots,), np.float64, self.shm.buf, 8 * (1 + slots))
+        self._images = np.ndarray((slots, *shape), dtype, self.shm.buf, header_bytes)
+        if self.owner:
+            self._counter[0] = 0
+            self._sequences[:] = -1
+
+        # Private to the reading side; handed out in rotation so a returned frame survives the next read
+        self._reader_buffers = reader_buffers
+        self._out: List[np.ndarray] = []
+        self._next_out = 0
+
+    @property
+    def spec(self):
+        """
+        Arguments that attach another FrameRingBuffer to the same shared memory.
+        """
+        return self.shape, self.dtype.str, self.slots, self.shm.name
+
+    @property
+    def latest(self) -> int:
+        """
+        Sequence number of the newest complete frame, 0 if nothing has been written.
+        """
+        return int(self._counter[0])
+
+    def slot_for_write(self) -> np.ndarray:
+        """
+        Claims the slot for the next frame and marks it invalid until `commit`.
+        Capture code may decode directly into the returned array.
+        """
+        sequence = self.latest + 1
+        slot = sequence % self.slots
+        self._sequences[slot] = -1
+        return self._images[slot]
+
+    def commit(self, timestamp: float) -> int:
+        """
+        Publishes the frame written into the slot from `slot_for_write`.
+
+        Returns:
+            int: Sequence number of the published frame
+        """
+        sequence = self.latest + 1
+        slot = sequence % self.slots
+        self._timestamps[slot] = timestamp
+        self._sequences[slot] = sequence
+        self._counter[0] = sequence
+        return sequence
+
+    def write(self, image: np.ndarray, timestamp: float) -> int:
+        """
+        Copies a frame into the next slot and publishes it.
+        """
+        np.copyto(self.slot_for_write(), image)
+        return self.commit(timestamp)
+
+    def history(self) -> List[Frame]:
+        """
+        Metadata of every complete frame still held, oldest first. Images are not copied.
+        """
+        frames = [
+            Frame(int(sequence), float(timestamp), None)
+            for sequence, timestamp in zip(self._sequences, self._timestamps)
+            if sequence > 0
+        ]
+        return sorted(frames, key=lambda frame: frame.sequence)
+
+    def read(self, sequence: int = None) -> Optional[Frame]:
+        """
+        Copies a frame out of shared memory into a reader-side buffer.
+        The returned image is reused after `reader_buffers` further reads.
+
+        Args:
+            sequence (int): Frame to read, the latest if None
+
+        Returns:
+            Frame | None: The frame, or None if it has been or is being overwritten
+        """
+        if sequence is None:
+            sequence = self.latest
+        if sequence <= 0:
+            return None
+
+        slot = sequence % self.slots
+        if self._sequences[slot] != sequence:
+            return None
+        timestamp = float(self._timestamps[slot])
+
+        if len(self._out) < self._reader_buffers:
+            self._out.append(np.empty(self.shape, self.dtype))
+        out = self._out[self._next_out % len(self._out)]
+        np.copyto(out, self._images[slot])
+
+        # The writer may have lapped us during the copy, in which case the buffer is free to reuse
+        if self._sequences[slot] != sequence:
+            return None
+        # Only frames handed out use up a buffer, so each stays valid for `reader_buffers` reads
+        self._next_out += 1
+        return Frame(sequence, timestamp, out)
+
+    def close(self):
+        self._counter = self._sequences = self._timestamps = self._images = None
+        self._out = []
+        try:
+            self.shm.close()
+        except BufferError:
+            # A capture thread still holds a slot, the mapping goes when it does
+            pass
+        if self.owner:
+            self.shm.unlink()
\ No newline at end of file
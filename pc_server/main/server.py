@@ -48,7 +48,8 @@ class WebSocketServer:
         Continuously checks the data queue for new data and sends it to all connected clients.
         """
         while True:
-            if not self.data_queue.empty():
+            # Overlays arrive once per frame per camera, so send everything queued rather than one message per pass
+            while not self.data_queue.empty():
                 data = self.data_queue.get()
                 disconnected_clients = set()
                 clients = list(self.clients)
@@ -0,0 +1,70 @@
+###
+# Pairs up frames from multiple cameras by their capture time
+###
+
+import time
+from typing import List, Optional
+from interfaces import Frame
+
+class FrameSynchroniser:
+    """
+    Hands out sets of frames, one per camera, whose timestamps lie within a tolerance of each other.
+    Each frame is handed out at most once, so a camera that stalls stalls the whole set.
+    Sources must expose `history()`, the metadata of recently held Frames, and `read(sequence)`.
+    Writers must publish frames while holding `new_frame` and notify it.
+    """
+    def __init__(self, sources, new_frame, tolerance: float = 0.02, timeout: float = 1.0):
+        self.sources = sources
+        self.new_frame = new_frame
+        self.tolerance = tolerance
+        self.timeout = timeout
+        self.last_sequences = [0 for _ in sources]
+
+    def match(self) -> Optional[List[Frame]]:
+        """
+        Searches the recent history of every camera for an unused set of frames within tolerance.
+        The newest frame of the camera that is furthest behind acts as the reference.
+
+        Returns:
+            List[Frame] | None: Metadata of one frame per camera, or None if no new set exists yet
+        """
+        histories = [source.history() for source in self.sources]
+        if not all(histories):
+            return None
+
+        reference = min((history[-1] for history in histories), key=lambda frame: frame.timestamp)
+
+        matched: List[Frame] = []
+        for history, last in zip(histories, self.last_sequences):
+            candidates = [frame for frame in history if frame.sequence > last]
+            if not candidates:
+                return None
+            best = min(candidates, key=lambda frame: abs(frame.timestamp - reference.timestamp))
+            if abs(best.timestamp - reference.timestamp) > self.tolerance:
+                return None
+            matched.append(best)
+
+        return matched
+
+    def __call__(self) -> Optional[List[Frame]]:
+        """
+        Blocks until a new synchronised set of frames exists or the timeout expires.
+
+        Returns:
+            List[Frame] | None: One frame per camera, or None on timeout
+        """
+        deadline = time.monotonic() + self.timeout
+        while (remaining := deadline - time.monotonic()) > 0:
+            with self.new_frame:
+                matched = self.new_frame.wait_for(self.match, remaining)
+            if matched is None:
+                return None
+
+            # Copy out of the sources without blocking writers
+            frames = [source.read(frame.sequence) for source, frame in zip(self.sources, matched)]
+            if all(frame is not None for frame in frames):
+                self.last_sequences = [frame.sequence for frame in frames]
+                return frames
+            # A slot was overwritten mid-copy, move on to newer frames
+            self.last_sequences = [frame.sequence for frame in matched]
+        return None
\ No newline at end of file
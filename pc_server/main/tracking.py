@@ -2,107 +2,468 @@
 # Track objects in 2D and 3D once cameras are calibrated
 ###
 
-from typing import Dict, List, Tuple
-import pandas as pd
+from collections import deque
+from enum import Enum
+import heapq
+import os
+from typing import Deque, Dict, Iterator, List, Tuple
 import numpy as np
+import torch
+from scipy.optimize import linear_sum_assignment
 from ultralytics.engine.results import Results
 from ultralytics import YOLO
 import cv2
 import json
-from interfaces import XYTrack, XYTracks, XYZTracks, IDPair
+import threading
+from interfaces import XYTracks, XYZTracks, IDGroup, Points3D
+from motion import KalmanTracks, MotionGate
+from calibration_store import CameraParams
+
+def track_arrays(tracks: XYTracks) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Splits tracks into an array of IDs and an (N, 2) array of their coordinates
+    """
+    ids = np.fromiter(tracks.keys(), dtype=np.int64, count=len(tracks))
+    points = np.array(list(tracks.values()), dtype=np.float64).reshape(-1, 2)
+    return ids, points
+
+def associate(tracks: XYTracks, detections: np.ndarray, gate: float = 1000.) -> Tuple[List[Tuple[int, int]], List[int]]:
+    """
+    Globally optimal assignment of detections to existing tracks by Euclidean distance.
+    The full distance matrix is computed in one pass and solved with the Hungarian algorithm.
+
+    Args:
+        tracks (XYTracks): ID: (x, y) of the previous frame
+        detections (np.ndarray): (N, 2) coordinates in the current frame
+        gate (float): Pairs further apart than this are never matched
+
+    Returns:
+        List[Tuple[int, int]]: (track ID, detection index) of each match
+        List[int]: Indices of detections that matched no track
+    """
+    if len(tracks) == 0 or len(detections) == 0:
+        return [], list(range(len(detections)))
+
+    ids, previous = track_arrays(tracks)
+
+    distances = np.linalg.norm(previous[:, None, :] - detections[None, :, :2], axis=2)
+    # Gated pairs cost more than any valid assignment could, so they are only chosen when nothing else is left
+    costs = np.where(distances <= gate, distances, gate * (len(previous) + len(detections) + 1))
+    rows, cols = linear_sum_assignment(costs)
+    valid = distances[rows, cols] <= gate
+    rows, cols = rows[valid], cols[valid]
+
+    unmatched = np.ones(len(detections), dtype=bool)
+    unmatched[cols] = False
+
+    return list(zip(ids[rows].tolist(), cols.tolist())), np.flatnonzero(unmatched).tolist()
+
+def undistort_points(points: np.ndarray, K: np.ndarray, dist: np.ndarray) -> np.ndarray:
+    """
+    Removes lens distortion from (N, 2) pixel coordinates, keeping them in pixels of the same camera
+    """
+    if len(points) == 0:
+        return np.zeros((0, 2))
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 1, 2)
+    return cv2.undistortPoints(points, K, dist, P=K).reshape(-1, 2)
+
+def epipolar_distances(F: np.ndarray, pts1: np.ndarray, pts2: np.ndarray) -> np.ndarray:
+    """
+    Symmetric epipolar distance in pixels between every pair of points from two cameras:
+    the distance of each point from the other's epipolar line, summed over both images.
+
+    Args:
+        F (np.ndarray): Fundamental matrix, with pts2_h.T @ F @ pts1_h = 0 for true correspondences
+        pts1 (np.ndarray): (N, 2) points in the first camera
+        pts2 (np.ndarray): (M, 2) points in the second camera
+
+    Returns:
+        np.ndarray: (M, N) distances, row per point in the second camera
+    """
+    pts1_h = np.column_stack((pts1, np.ones(len(pts1))))
+    pts2_h = np.column_stack((pts2, np.ones(len(pts2))))
+    # Epipolar lines of each point in the other image
+    lines2 = pts1_h @ F.T
+    lines1 = pts2_h @ F
+    errors = np.abs(pts2_h @ lines2.T)
+    return errors / np.linalg.norm(lines2[:, :2], axis=1)[None, :] + errors / np.linalg.norm(lines1[:, :2], axis=1)[:, None]
+
+def triangulate_views(P: np.ndarray, points: np.ndarray, seen: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Linear (DLT) triangulation of many points at once, each from whichever cameras saw it
+    Every point's equations are stacked for all cameras, with those of cameras that missed it zeroed,
+    so one batched SVD solves them all whatever the mix of views
+
+    Args:
+        P (np.ndarray): (C, 3, 4) projection matrices
+        points (np.ndarray): (N, C, 2) image coordinates of each point in each camera
+        seen (np.ndarray): (N, C) whether each camera saw each point, at least two per point
+
+    Returns:
+        np.ndarray: (N, 3) positions in the first camera's frame
+        np.ndarray: (N,) RMS reprojection error in pixels across the cameras that saw each point
+    """
+    if len(points) == 0:
+        return np.zeros((0, 3)), np.zeros(0)
+
+    # x * P[2] - P[0] and y * P[2] - P[1] for every point and camera
+    rows = points[:, :, :, None] * P[None, :, 2:3, :] - P[None, :, :2, :]
+    rows = rows * seen[:, :, None, None]
+    A = rows.reshape(len(points), -1, 4)
+    # Unit rows keep distant cameras from outweighing near ones
+    norms = np.linalg.norm(A, axis=2, keepdims=True)
+    A = A / np.where(norms > 0, norms, 1)
+    homogeneous = np.linalg.svd(A)[2][:, -1]
+
+    projected = np.einsum("cij,nj->nci", P, homogeneous)
+    residuals = np.linalg.norm(projected[:, :, :2] / projected[:, :, 2:] - points, axis=2)
+    residuals = np.where(seen, residuals, 0)
+    errors = np.sqrt((residuals ** 2).sum(axis=1) / seen.sum(axis=1))
+
+    return homogeneous[:, :3] / homogeneous[:, 3:], errors
+
+def load_rois(path: str) -> Tuple[List[Tuple[int, int, int, int]] | None, Tuple[int, int] | None]:
+    """
+    Reads the per-camera regions of interest saved by calibration.CameraCalibrator.save_rois
+
+    Returns:
+        List[Tuple[int, int, int, int]] | None: (x0, y0, x1, y1) per camera, None if no file has been saved
+        Tuple[int, int] | None: (width, height) of the frames they were drawn on, None if not saved
+    """
+    if not os.path.exists(path):
+        print(f"No regions of interest at {path}, using full frames")
+        return None, None
+    with open(path) as f:
+        saved = json.load(f)
+    resolution = tuple(saved["resolution"]) if "resolution" in saved else None
+    return [tuple(roi) for roi in saved["rois"]], resolution
+
+def tile_regions(roi: Tuple[int, int, int, int], tiles: Tuple[int, int], overlap: float) -> List[Tuple[int, int, int, int]]:
+    """
+    Splits a region into a grid of equally sized, overlapping tiles
+
+    Args:
+        roi (Tuple[int, int, int, int]): (x0, y0, x1, y1) to cover
+        tiles (Tuple[int, int]): Columns and rows of tiles
+        overlap (float): Fraction of a tile shared with its neighbour, so objects on a seam appear whole in one tile
+    """
+    x0, y0, x1, y1 = roi
+    columns, rows = tiles
+    width = (x1 - x0) / (columns - (columns - 1) * overlap)
+    height = (y1 - y0) / (rows - (rows - 1) * overlap)
+    regions = []
+    for row in range(rows):
+        for column in range(columns):
+            left = x0 + round(column * width * (1 - overlap))
+            top = y0 + round(row * height * (1 - overlap))
+            regions.append((left, top, min(x1, round(left + width)), min(y1, round(top + height))))
+    return regions
+
+class TrackState(Enum):
+    # Seen, but not yet on enough frames to be reported
+    TENTATIVE = 0
+    # Reported and matched on the latest detection pass
+    CONFIRMED = 1
+    # Reported at its predicted position after a missed detection
+    COASTING = 2
+    # Gone for longer than the maximum age, its ID may be reused
+    DELETED = 3
+
+class TrackRecord:
+    """
+    Lifecycle bookkeeping for a single 2D track, counted in detection passes
+    """
+    __slots__ = ("state", "hits", "misses")
+
+    def __init__(self, min_hits: int):
+        self.hits = 1
+        self.misses = 0
+        self.state = TrackState.CONFIRMED if min_hits <= 1 else TrackState.TENTATIVE
+
+    def hit(self, min_hits: int):
+        self.hits += 1
+        self.misses = 0
+        self.state = TrackState.CONFIRMED if self.hits >= min_hits else TrackState.TENTATIVE
+
+    def miss(self, max_age: int):
+        self.misses += 1
+        if self.state is TrackState.TENTATIVE or self.misses > max_age:
+            self.state = TrackState.DELETED
+        else:
+            self.state = TrackState.COASTING
+
+    @property
+    def visible(self) -> bool:
+        return self.state is TrackState.CONFIRMED or self.state is TrackState.COASTING
+
+class IDPool:
+    """
+    Hands out the smallest free ID, keeping the ID space compact over long runs.
+    Released IDs are held back for `cooldown` frames so downstream maps forget them before they return.
+    """
+    def __init__(self, first: int = 1, cooldown: int = 30):
+        self.next_id = first
+        self.cooldown = cooldown
+        self.free: List[int] = []
+        self.cooling: Deque[Tuple[int, int]] = deque()
+
+    def acquire(self, frame: int) -> int:
+        while self.cooling and frame - self.cooling[0][0] >= self.cooldown:
+            heapq.heappush(self.free, self.cooling.popleft()[1])
+        if self.free:
+            return heapq.heappop(self.free)
+        self.next_id += 1
+        return self.next_id - 1
+
+    def release(self, track_id: int, frame: int):
+        self.cooling.append((frame, track_id))
 
 class Track2D:
     """
     Implements direct tracking of objects in 2D
-    Can batch process frames from multiple cameras
+    Batch processes frames from any number of cameras in a single inference call
+    Each track carries a constant-velocity Kalman filter, so detection can be skipped on some frames
+    with positions predicted in between: every `detect_every` frames, or sooner once any track's
+    position uncertainty exceeds `max_uncertainty` pixels.
+    Tracks are only reported after `min_hits` detections, and coast on their prediction for up to
+    `max_age` missed detections before being deleted and their ID returned to the pool.
+    Inference can be restricted to each camera's calibrated region of interest, and split into
+    overlapping `tiles` so small objects survive downscaling to `imgsz`. Results are always mapped
+    back to full-frame coordinates.
+    Models exported with a fixed `batch` size are given exactly that many images per call, in as many calls as it takes.
+    With a `motion_threshold`, cameras whose region of interest has not changed skip inference and
+    prediction entirely, keeping their previous tracks.
     """
-    def __init__(self):
-        # Point to desired model
-        self.model = YOLO("models/led.pt")
-        self.tracks_on_cameras: List[XYTracks] = [{}, {}]
-        self.next_id = 1
+    def __init__(self, cameras: int = 2, gate: float = 1000., detect_every: int = 1, max_uncertainty: float = None,
+                 process_noise: float = 2., measurement_noise: float = 1., min_hits: int = 1, max_age: int = 0, id_cooldown: int = 30,
+                 model: str = "models/led.pt", device=0, imgsz: int = 640, batch: int = None,
+                 rois: str | List[Tuple[int, int, int, int]] = None, roi_resolution: Tuple[int, int] = None, tiles: Tuple[int, int] = None, overlap: float = 0.2, tile_iou: float = 0.5,
+                 motion_threshold: float = None, motion_area: float = 0.0005):
+        # Point to desired model, the runtime follows the file type: .pt for PyTorch, .onnx for ONNX Runtime
+        # or an _openvino_model directory for OpenVINO. Export CPU models with inference.py
+        self.model = YOLO(model, task="detect")
+        # 0 for the first CUDA GPU, "cpu" for exported models on GPU-less machines
+        self.device = device
+        # Exported models have a fixed input size and batch size, which must match here. None for any batch size
+        self.imgsz = imgsz
+        self.batch = batch
+        # (x0, y0, x1, y1) per camera, or a path to those saved during calibration
+        # Calibration draws them on frames of `roi_resolution` (width, height), None if drawn on full size frames
+        if isinstance(rois, str):
+            rois, roi_resolution = load_rois(rois)
+        self.rois = rois
+        self.roi_resolution = roi_resolution
+        self.tiles = tiles
+        self.overlap = overlap
+        # Overlap above which detections from neighbouring tiles are the same object
+        self.tile_iou = tile_iou
+        # Grey level change that counts as movement, None to run inference on every frame
+        self.motion = MotionGate(cameras, motion_threshold, motion_area) if motion_threshold is not None else None
+        self.tracks_on_cameras: List[XYTracks] = [{} for _ in range(cameras)]
+        self.filters = [KalmanTracks(2, 1, process_noise, measurement_noise) for _ in range(cameras)]
+        self.records: List[Dict[int, TrackRecord]] = [{} for _ in range(cameras)]
+        self.ids = IDPool(1, id_cooldown)
+        self.frame = 0
+        # Furthest in pixels a track may move between frames and keep its ID
+        self.gate = gate
+        self.detect_every = detect_every
+        self.max_uncertainty = max_uncertainty
+        self.frames_since_detection = detect_every
+        self.min_hits = min_hits
+        self.max_age = max_age
         print(self.model.info())
 
-    def find_best(self, track1: XYTrack, tracks2: XYTracks, thres = 1000.):
+    def visible(self, camera: int, positions: XYTracks) -> XYTracks:
+        """
+        Drops tracks that are not yet, or no longer, reported.
+        """
+        records = self.records[camera]
+        return {track_id: position for track_id, position in positions.items() if records[track_id].visible}
+
+    def predict(self, cameras: List[int] = None) -> List[XYTracks]:
+        """
+        Advances every track on the given cameras, or all of them, by one frame using its motion model.
+        """
+        for i in cameras if cameras is not None else range(len(self.filters)):
+            kalman = self.filters[i]
+            kalman.predict()
+            ids, positions = kalman.positions()
+            self.tracks_on_cameras[i] = self.visible(i, {track_id: (x, y) for track_id, (x, y) in zip(ids, positions.tolist())})
+        return self.tracks_on_cameras
+
+    def needs_detection(self) -> bool:
+        if self.frames_since_detection >= self.detect_every:
+            return True
+        if self.max_uncertainty is None:
+            return False
+        return any(len(kalman) and kalman.uncertainty()[1].max() > self.max_uncertainty for kalman in self.filters)
+
+    def roi(self, frame: np.ndarray, camera: int) -> Tuple[int, int, int, int]:
         """
-        Linear search for the shortest distance between a coordinate and a set of coordinates
+        The camera's region of interest scaled and clipped to the frame, or the whole frame without one
+        """
+        height, width = frame.shape[:2]
+        if self.rois is None:
+            return (0, 0, width, height)
+        x0, y0, x1, y1 = self.rois[camera]
+        if self.roi_resolution is not None and tuple(self.roi_resolution) != (width, height):
+            # Drawn on frames of another size, e.g. calibration's 640x640 preview of a 2048x2048 stream
+            scale_x, scale_y = width / self.roi_resolution[0], height / self.roi_resolution[1]
+            x0, x1 = int(x0 * scale_x), int(round(x1 * scale_x))
+            y0, y1 = int(y0 * scale_y), int(round(y1 * scale_y))
+        return (max(0, x0), max(0, y0), min(width, x1), min(height, y1))
+
+    def regions(self, frame: np.ndarray, camera: int) -> List[Tuple[int, int, int, int]]:
+        """
+        The (x0, y0, x1, y1) regions of a frame that inference runs on
+        """
+        roi = self.roi(frame, camera)
+        return tile_regions(roi, self.tiles, self.overlap) if self.tiles is not None else [roi]
 
-        Args: 
-            track1 (XYTrack): Coordinate of the object in a frame
-            tracks2 (XYTracks): All coordinates of the objects in another frame
+    def merge(self, frame: np.ndarray, regions: List[Tuple[int, int, int, int]], pieces: List[Results]) -> Results:
+        """
+        Combines the detections from each region of a frame into one full-frame result
+        """
+        boxes = []
+        for (x0, y0, _, _), piece in zip(regions, pieces):
+            data = piece.boxes.data.cpu().numpy().copy()
+            data[:, [0, 2]] += x0
+            data[:, [1, 3]] += y0
+            boxes.append(data)
+        data = np.concatenate(boxes) if boxes else np.zeros((0, 6), dtype=np.float32)
+
+        if len(regions) > 1 and len(data):
+            # Objects on a seam are found by more than one tile
+            xywh = np.column_stack((data[:, :2], data[:, 2:4] - data[:, :2]))
+            keep = cv2.dnn.NMSBoxes(xywh.tolist(), data[:, 4].tolist(), 0., self.tile_iou)
+            data = data[np.array(keep, dtype=np.int64).reshape(-1)]
+
+        return Results(frame, path="", names=self.model.names, boxes=torch.from_numpy(data))
+
+    def detect(self, frames, cameras: List[int] = None) -> List[Results]:
+        """
+        Runs the detector on every camera's frame, or on its regions of interest and tiles, as one batch
 
-        Returns:
-            int: The ID of the best match in tracks2
-            float | floating[Any]: The distance between the two coordinates
+        Args:
+            frames: One frame per camera in `cameras`
+            cameras (List[int]): Camera index of each frame, defaults to all cameras in order
         """
-        idx, best = -1, thres
-        for j, track2 in tracks2.items():
-            s =  np.linalg.norm(np.array(track1) - np.array(track2))
-            if s <= best:
-                idx, best = j, s
+        if cameras is None:
+            cameras = list(range(len(frames)))
+        if self.rois is None and self.tiles is None:
+            regions = None
+            batch = frames
+        else:
+            regions = [self.regions(frame, i) for i, frame in zip(cameras, frames)]
+            batch = [frame[y0:y1, x0:x1] for frame, camera_regions in zip(frames, regions) for x0, y0, x1, y1 in camera_regions]
+
+        results = self.infer(batch)
+        if regions is None:
+            return results
 
-        return idx, best
+        merged, start = [], 0
+        for frame, camera_regions in zip(frames, regions):
+            merged.append(self.merge(frame, camera_regions, results[start:start + len(camera_regions)]))
+            start += len(camera_regions)
+        return merged
 
-    def track(self, result: Results, tracks: XYTracks) -> XYTracks:
+    def infer(self, images: List[np.ndarray]) -> List[Results]:
         """
-        Searches for the best match between the current frame and the previous frame
+        Runs the detector on a list of images, one result per image
+        """
+        if self.batch is None:
+            # A list of images is inferred as one batch, so each camera grows the batch rather than the number of calls
+            return self.model(images, iou=0.7, conf=0.25, imgsz=self.imgsz, device=self.device, verbose=False)
+
+        results: List[Results] = []
+        for start in range(0, len(images), self.batch):
+            chunk = images[start:start + self.batch]
+            # A fixed batch must be full, so repeat the last image and discard its extra results
+            padded = chunk + [chunk[-1]] * (self.batch - len(chunk))
+            results.extend(self.model(padded, iou=0.7, conf=0.25, imgsz=self.imgsz, device=self.device, verbose=False)[:len(chunk)])
+        return results
+
+    def track(self, result: Results, camera: int) -> XYTracks:
+        """
+        Searches for the best match between the current frame and the predicted tracks of the previous frame
 
         Args:
             result (Results): YOLO results for the current frame
-            tracks (XYTracks): ID: (x, y) of the previous frame
+            camera (int): Index of the camera the result came from
         """
         if result.boxes.xywh is None:
             return
-        
-        next_tracks = result.boxes.xywh.cpu()#.reshape(-1, 2)
-        # print(next_tracks)
-        next_tracks = {i: (x[0].item(), x[1].item()) for i, x in enumerate(next_tracks)}
-
-        assigned: XYTracks = {}
-        while len(next_tracks) > 0 and len(tracks) > 0:
-            for i, track in tracks.items():
-                # Previous track finds its best match
-                idx, s = self.find_best(track, next_tracks, 1000)
-                if idx != -1: 
-                    # Current track confims that this is the best match
-                    confirm, _ = self.find_best(next_tracks[idx], tracks, s)
-                    if confirm == i:
-                        assigned[i] = (next_tracks[idx][0], next_tracks[idx][1])
-                        del next_tracks[idx]
-
-            tracks = {k: v for k, v in tracks.items() if k not in assigned.keys()}
-
-        # print(f"Maintained tracks {assigned}")
-
-        for track in next_tracks.values():
-            assigned[self.next_id] = (track[0], track[1])
-            # print(f"New track {self.next_id} at {track[0]}, {track[1]}")
-            self.next_id += 1
-
-        return assigned
+
+        kalman = self.filters[camera]
+        records = self.records[camera]
+        detections = result.boxes.xywh.cpu().numpy()[:, :2]
+        ids, predicted = kalman.positions()
+        predicted: XYTracks = {track_id: (x, y) for track_id, (x, y) in zip(ids, predicted.tolist())}
+        matches, unmatched = associate(predicted, detections, self.gate)
+
+        positions: XYTracks = {i: (detections[j, 0].item(), detections[j, 1].item()) for i, j in matches}
+        kalman.update([i for i, _ in matches], detections[[j for _, j in matches]])
+        for track_id in positions:
+            records[track_id].hit(self.min_hits)
+
+        for track_id in ids:
+            if track_id in positions:
+                continue
+            record = records[track_id]
+            record.miss(self.max_age)
+            if record.state is TrackState.DELETED:
+                kalman.remove(track_id)
+                del records[track_id]
+                self.ids.release(track_id, self.frame)
+            else:
+                positions[track_id] = predicted[track_id]
+
+        for j in unmatched:
+            track_id = self.ids.acquire(self.frame)
+            positions[track_id] = (detections[j, 0].item(), detections[j, 1].item())
+            kalman.add(track_id, detections[j])
+            records[track_id] = TrackRecord(self.min_hits)
+
+        return self.visible(camera, positions)
 
     def __call__(self, frames) -> Tuple[List[Results], List[XYTracks]]:
         """
         Matches current frame to tracks in previous frame
         Returns a list of results and a list of tracks for each camera
+        Results are None on frames where positions were predicted rather than detected,
+        and for cameras the motion gate found static
 
         Args:
-            frames: Canon frames to be processed
+            frames: Canon frames to be processed, one per camera
         """
         if not all(frame is not None for frame in frames):
             return
-        results: List[Results] = self.model(
-            frames, 
-            iou=0.7,
-            conf=0.25,
-            # imgsz=(640, 640),
-            device=0,
-            verbose=False
-            )
-        if not all(result is not None for result in results):
-            return results
-        for i, (tracks, result) in enumerate(zip(self.tracks_on_cameras, results)):
-            self.tracks_on_cameras[i] = self.track(result, tracks)
+        self.frame += 1
+        if self.motion is not None:
+            crops = []
+            for i, frame in enumerate(frames):
+                x0, y0, x1, y1 = self.roi(frame, i)
+                crops.append(frame[y0:y1, x0:x1])
+            moving = self.motion(crops)
+            cameras = [i for i, moved in enumerate(moving) if moved]
+        else:
+            cameras = list(range(len(frames)))
+        # Static cameras keep their previous tracks as they are
+        if not cameras:
+            return [None for _ in frames], self.tracks_on_cameras
+        self.predict(cameras)
+        self.frames_since_detection += 1
+        if not self.needs_detection():
+            return [None for _ in frames], self.tracks_on_cameras
+        self.frames_since_detection = 0
+
+        detected = self.detect([frames[i] for i in cameras], cameras)
+        if not all(result is not None for result in detected):
+            return detected
+        results: List[Results | None] = [None for _ in frames]
+        for i, result in zip(cameras, detected):
+            results[i] = result
+            self.tracks_on_cameras[i] = self.track(result, i)
         # print(self.tracks_on_cameras)
 
         return results, self.tracks_on_cameras
@@ -110,194 +471,368 @@ class Track2D:
 
 class Track3D:
     """
-    Tracks objects in a 3D space using two cameras
-    Matches 2D coordinates from two cameras using their Eucilidean plane
-    Perform calibration beforehand, save the fundamental matrix to camera_params.json as F
+    Tracks objects in a 3D space using two or more cameras
+    Groups 2D coordinates across cameras one-to-one by their distance from each other's epipolar lines,
+    favouring the groupings of the previous frame, and triangulates each object from every camera that sees it
+    Perform calibration beforehand and save it to camera_params.json, see CameraParams for its contents
+    A new calibration passed to `set_calibration` takes over from the next frame
+    Triangulated positions are smoothed by a constant-acceleration Kalman filter per 3D ID, which also
+    estimates velocity and acceleration. While fewer than two cameras see an object its position is predicted,
+    for up to `max_coast` frames.
     """
-    def __init__(self, bounds: Tuple[int, int, int], obj_count = 100):
+    def __init__(self, bounds: Tuple[int, int, int], obj_count = 100, params: str | CameraParams = "camera_params.json",
+                 epipolar_gate: float = 10., prior: float = 2., process_noise: float = 5000., measurement_noise: float = 2.,
+                 max_coast: int = 15, frame_interval: float = 1 / 30):
         self.tracking: XYZTracks = {}
-        self.idMap: Dict[int, IDPair] = {}
-        self.ids = [i for i in range(0, obj_count)]
+        self.bounds = bounds
         # Camera calibration
-        params = json.load(open("camera_params.json"))
-        self.offsets = np.array(params["offsets"])
-        # OpenCV's coordinate system is different
-        self.scales = [bounds[1], bounds[2], bounds[0]] / np.array(params["scales"])
-        self.p1 = np.array(params['P1'])
-        self.p2 = np.array(params['P2'])
-        self.F = np.array(params["F"])
+        self.calibration: CameraParams = None
+        self.pending: CameraParams = None
+        # set_calibration runs on the calibration store's thread, tracking on the pipeline's
+        self.pending_lock = threading.Lock()
+        self.apply_calibration(CameraParams.load(params) if isinstance(params, str) else params)
+        self.cameras = self.calibration.cameras
+
+        # 3D ID: 2D ID in each camera, with a placeholder for cameras that have not matched
+        self.idMap: Dict[int, IDGroup] = {}
+        # 2D ID: 3D ID for each camera
+        self.id_maps: List[Dict[int, int]] = [{} for _ in range(self.cameras)]
+        # Unused 3D IDs as a heap, so the smallest is always handed out first
+        self.free_ids = list(range(0, obj_count))
+        # IDs handed out on the latest frame, whose previous owner's state must not carry over
+        self.new_ids: List[int] = []
         self.unassigned = obj_count
         self.obj_count = obj_count
-    
-    def match_by_location(self, deep_df: pd.DataFrame, wide_df: pd.DataFrame) -> List[IDPair]:
+        # Furthest in pixels a point may be from the epipolar lines of the others in its group
+        self.epipolar_gate = epipolar_gate
+        # Pixels taken off the distance of points that were grouped on the previous frame, so close calls keep their grouping
+        self.prior = prior
+        # Noise is in mm, with process noise on the rate of change of acceleration
+        self.motion = KalmanTracks(3, 2, process_noise, measurement_noise)
+        # Frames since each 3D ID was last triangulated
+        self.coasting: Dict[int, int] = {}
+        self.max_coast = max_coast
+        # Seconds between frames when no timestamps are given
+        self.frame_interval = frame_interval
+        self.timestamp = None
+
+    def match_by_location(self, ids: List[np.ndarray], points: List[np.ndarray]) -> List[IDGroup]:
         """
-        Lists the IDs of objects that are on the same Eucilidean plane within a threshold
-        """
-        equalHeight: List[IDPair] = []
-
-        pts1 = np.array([deep_df["x"], deep_df["y"]], dtype=np.float64).T
-        pts2 = np.array([wide_df["x"], wide_df["y"]], dtype=np.float64).T
-        pts1_h = cv2.convertPointsToHomogeneous(pts1).reshape(-1, 3)
-        pts2_h = cv2.convertPointsToHomogeneous(pts2).reshape(-1, 3)
-
-        errors: np.ndarray = np.abs(pts2_h @ self.F @ pts1_h.T)
-
-        # print(f"Errors: {errors}")
-
-        inliers = np.where(errors < 0.05)
-
-        # print(inliers)
+        Groups at most one point from each camera, adding each camera's points in turn to the groups formed so far
+        Each addition is a min-cost assignment on the mean epipolar distance from the group's points
+        Objects without a counterpart within the gate are grouped with placeholders
 
-        rows, cols = inliers
-        for r, c in zip(rows, cols):
-            # print(f"Inlier at row {r}, col {c} — pts2[{r}] with pts1[{c}]")
-            equalHeight.append((deep_df.index[c], wide_df.index[r]))
-            
-        # Unassigned IDs should be unique so that they are never maintained across frames
-        for i, _ in deep_df.iterrows():
-            if i not in [pair[0] for pair in equalHeight]:
-                equalHeight.append((i, -self.unassigned))
-                self.unassigned += 1
-
-        for i, _ in wide_df.iterrows():
-            if i not in [pair[1] for pair in equalHeight]:
-                equalHeight.append((-self.unassigned, i))
-                self.unassigned += 1
-
-        return equalHeight
-
-    def update_internal_ids(self, equalHeight: List[IDPair]):
+        Args:
+            ids (List[np.ndarray]): 2D IDs in each camera
+            points (List[np.ndarray]): (N, 2) undistorted coordinates in each camera
+        """
+        # Placeholders only need to be unique within a frame, as they are never scored across frames
+        self.unassigned = self.obj_count
+
+        # The 3D ID each point had on the previous frame, -1 for none
+        previous = [np.array([id_map.get(i, -1) for i in camera_ids.tolist()], dtype=np.int64)
+                    for id_map, camera_ids in zip(self.id_maps, ids)]
+        # Row of each group's point in each camera, -1 where the camera has none
+        members = np.full((0, self.cameras), -1, dtype=np.int64)
+
+        for camera in range(self.cameras):
+            count = len(ids[camera])
+            if len(members) and count:
+                # Row g, column p compares group g with point p of this camera
+                totals = np.zeros((len(members), count))
+                worst = np.zeros((len(members), count))
+                views = np.zeros(len(members))
+                regrouped = np.zeros((len(members), count), dtype=bool)
+                for other in range(camera):
+                    seen = members[:, other] >= 0
+                    if not seen.any():
+                        continue
+                    rows = members[seen, other]
+                    distances = epipolar_distances(self.F[other, camera], points[other][rows], points[camera]).T
+                    totals[seen] += distances
+                    worst[seen] = np.maximum(worst[seen], distances)
+                    views[seen] += 1
+                    regrouped[seen] |= (previous[other][rows][:, None] == previous[camera][None, :]) & (previous[camera][None, :] >= 0)
+
+                # Every pair in a group must be within the gate, and groups are scored on their mean
+                gated = (views[:, None] == 0) | (worst > self.epipolar_gate)
+                costs = totals / np.maximum(views, 1)[:, None] - self.prior * regrouped
+                # Gated pairs cost more than any valid assignment could, so they are only chosen when nothing else is left
+                costs[gated] = (self.epipolar_gate + self.prior) * (len(members) + count + 1)
+                groups, columns = linear_sum_assignment(costs)
+                valid = ~gated[groups, columns]
+                members[groups[valid], camera] = columns[valid]
+                unmatched = np.ones(count, dtype=bool)
+                unmatched[columns[valid]] = False
+            else:
+                unmatched = np.ones(count, dtype=bool)
+
+            # Points without a group start their own
+            new = np.full((np.count_nonzero(unmatched), self.cameras), -1, dtype=np.int64)
+            new[:, camera] = np.flatnonzero(unmatched)
+            members = np.concatenate((members, new))
+
+        # Unassigned IDs should be unique so that they never clash within a frame
+        groups: List[IDGroup] = []
+        for rows in members.tolist():
+            group = []
+            for camera, row in enumerate(rows):
+                if row >= 0:
+                    group.append(ids[camera][row].item())
+                else:
+                    group.append(-self.unassigned)
+                    self.unassigned += 1
+            groups.append(tuple(group))
+        return groups
+
+    def update_internal_ids(self, groups: List[IDGroup]):
         """
-        Maps the IDs of objects that share the same height in both frames
+        Carries 3D IDs over to this frame's groups through each camera's 2D IDs
+        A group keeps the 3D ID most of its 2D IDs had, otherwise another ID one of them had,
+        and failing that takes the smallest free ID. Groups that agree most are settled first.
 
         Args:
-            equalHeight (List[IDPair]): List of tuples containing the IDs of objects that share the same height in both frames.
-        """
-        newMap = {}
-        equalHeight_df = pd.DataFrame(equalHeight, columns=["dim0", "dim1"])
-        
-        # Check which mappings were exact across frames, then which maintained some similarity
-        for threshold in range(2, 0, -1):
-            for i, dims in self.idMap.items():
-                if equalHeight_df.empty:
+            groups (List[IDGroup]): 2D ID in each camera of every object, with placeholders for cameras that missed it
+        """
+        newMap: Dict[int, IDGroup] = {}
+        ranked: List[Tuple[int, IDGroup, List[int]]] = []
+
+        # Placeholder (non-positive) IDs are never in the maps, so never count towards continuity
+        for dims in groups:
+            votes: Dict[int, int] = {}
+            for id_map, dim in zip(self.id_maps, dims):
+                track_id = id_map.get(dim)
+                if track_id is not None:
+                    votes[track_id] = votes.get(track_id, 0) + 1
+            # Ties go to the earlier camera's ID
+            candidates = sorted(votes, key=lambda track_id: -votes[track_id])
+            ranked.append((votes[candidates[0]] if candidates else 0, dims, candidates))
+        ranked.sort(key=lambda entry: -entry[0])
+
+        unmatched: List[IDGroup] = []
+        for _, dims, candidates in ranked:
+            for track_id in candidates:
+                if track_id not in newMap:
+                    newMap[track_id] = dims
                     break
+            else:
+                unmatched.append(dims)
 
-                scores = equalHeight_df.apply(lambda row: np.sum(np.array(dims) == np.array([row["dim0"], row["dim1"]])), axis=1)
+        for track_id in self.idMap:
+            if track_id not in newMap:
+                heapq.heappush(self.free_ids, track_id)
 
-                # Find the best match if it meets the threshold
-                best_score = scores.max()
-                if best_score >= threshold:
-                    best_idx = scores.idxmax()
-                    match = equalHeight_df.loc[best_idx]
-                    newMap[i] = tuple(match)
+        self.new_ids = []
+        for dims in unmatched:
+            if not self.free_ids:
+                break
+            track_id = heapq.heappop(self.free_ids)
+            newMap[track_id] = dims
+            self.new_ids.append(track_id)
 
-                    # Remove rows with the same dim0 or dim1
-                    equalHeight_df = equalHeight_df[
-                        (equalHeight_df["dim0"] != match["dim0"]) & 
-                        (equalHeight_df["dim1"] != match["dim1"])
-                    ]
-                    # print(f"Matched {dims} with {tuple(match)}")
-            
-            self.idMap = {k: v for k, v in self.idMap.items() if k not in newMap.keys()}
+        self.idMap = newMap
+        self.id_maps = [
+            {dims[camera]: track_id for track_id, dims in newMap.items() if dims[camera] > 0}
+            for camera in range(self.cameras)
+        ]
+
+    def apply_calibration(self, params: CameraParams):
+        self.calibration = params
+        self.P = params.P
+        self.K = params.K
+        self.dist = params.dist
+        self.F = params.F
+        self.offsets = params.offsets
+        # OpenCV's coordinate system is different
+        bounds = self.bounds
+        self.scales = [bounds[1], bounds[2], bounds[0]] / params.scales
 
-        unassigned = [i for i in self.ids if i not in newMap.keys()]
+    def set_calibration(self, params: CameraParams):
+        """
+        Queues a new calibration, safe to call from any thread
+        It is applied between frames, so no frame is matched with one calibration and triangulated with another
+        """
+        if params.cameras != self.cameras:
+            print(f"Ignoring calibration for {params.cameras} cameras while tracking {self.cameras}, restart to change cameras")
+            return
+        with self.pending_lock:
+            self.pending = params
 
-        for id in unassigned:
-            if equalHeight_df.empty:
-                break
-            row = equalHeight_df.iloc[0]
-            # print(f"New track for {tuple(row)} at {self.next_id}")
-            newMap[id] = tuple(row)
-            equalHeight_df = equalHeight_df[
-                (equalHeight_df["dim0"] != row["dim0"]) & 
-                (equalHeight_df["dim1"] != row["dim1"])
-            ]
-        
-        self.idMap = newMap
+    def update_calibration(self):
+        with self.pending_lock:
+            params, self.pending = self.pending, None
+        if params is not None:
+            self.apply_calibration(params)
 
-    def merge_dataframes(self, wide_df: pd.DataFrame, deep_df: pd.DataFrame):
+    def undistort(self, camera: int, points: np.ndarray) -> np.ndarray:
+        """
+        Removes lens distortion from a camera's points, as F and the projection matrices were calibrated without it
         """
-        Merges two DataFrames based on a mapping of track_id pairs while updating x1 and x2.
+        if self.dist[camera] is None:
+            return points
+        return undistort_points(points, self.K[camera], self.dist[camera])
 
-        Args:
-            df1 (pd.DataFrame): First DataFrame containing track_id and box.
-            df2 (pd.DataFrame): Second DataFrame containing track_id and box.
+    def correspond(self, ids: List[np.ndarray], points: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Groups undistorted points across cameras and carries 3D IDs over from the previous frame
 
         Returns:
-            pd.DataFrame: Merged DataFrame with updated box values.
+            np.ndarray: 3D IDs seen by at least two cameras, in ascending order
+            np.ndarray: (N, C, 2) coordinates of each ID in each camera
+            np.ndarray: (N, C) whether each camera saw each ID
         """
-        deep_id_dict = {v[0]: k for k, v in self.idMap.items() if v[0] > 0}
-        wide_id_dict = {v[1]: k for k, v in self.idMap.items() if v[1] > 0}
-        # print(track_id_dict)
+        groups = self.match_by_location(ids, points)
+        self.update_internal_ids(groups)
+        return self.group_points(ids, points)
 
-        deep_df = deep_df[deep_df.index.isin(deep_id_dict.keys())]
-        wide_df = wide_df[wide_df.index.isin(wide_id_dict.keys())]
+    def group_points(self, ids: List[np.ndarray], points: List[np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Gathers the coordinates of every 3D ID seen by at least two cameras
 
-        # deep_df = deep_df.rename(columns={"track_id": "track_id_other"})
+        Returns:
+            np.ndarray: 3D IDs in ascending order
+            np.ndarray: (N, C, 2) coordinates of each ID in each camera, zero where unseen
+            np.ndarray: (N, C) whether each camera saw each ID
+        """
+        camera_rows = [dict(zip(camera_ids.tolist(), range(len(camera_ids)))) for camera_ids in ids]
 
-        # Map the 2D IDs to a single 3D ID
-        deep_df.index = deep_df.index.to_series().replace(deep_id_dict)
-        wide_df.index = wide_df.index.to_series().replace(wide_id_dict)
+        track_ids, rows = [], []
+        for track_id in sorted(self.idMap):
+            group_rows = [lookup.get(dim, -1) for lookup, dim in zip(camera_rows, self.idMap[track_id])]
+            if sum(row >= 0 for row in group_rows) >= 2:
+                track_ids.append(track_id)
+                rows.append(group_rows)
 
-        deep_df.columns = deep_df.columns.str.replace("y", "z1")
-        wide_df.columns = wide_df.columns.str.replace("y", "z2")
-        wide_df.columns = wide_df.columns.str.replace("x", "y")
+        rows = np.array(rows, dtype=np.int64).reshape(-1, self.cameras)
+        seen = rows >= 0
+        grouped = np.zeros((len(rows), self.cameras, 2))
+        for camera in range(self.cameras):
+            grouped[seen[:, camera], camera] = points[camera][rows[seen[:, camera], camera]]
 
-        # Merge both DataFrames based on track_id
-        merged_df = wide_df.merge(
-            deep_df[["x", "z1"]], 
-            left_index=True, right_index=True, how="outer")
+        return np.array(track_ids, dtype=np.int64), grouped, seen
 
-        return merged_df
-    
-    def triangulate_points(self, xzyz_df: pd.DataFrame) -> pd.DataFrame:
-        """
-        Uses camera parameters to triangulate points in 3D space
+    def triangulate_points(self, points: np.ndarray, seen: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
         """
-        x = xzyz_df["x"].to_numpy()
-        y = xzyz_df["y"].to_numpy()
-        z1 = xzyz_df["z1"].to_numpy()
-        z2 = xzyz_df["z2"].to_numpy()
+        Uses camera parameters to triangulate points in 3D space from every camera that saw them
 
-        pts1 = np.vstack((x, z1))
-        pts2 = np.vstack((y, z2))
-
-        homogeneous = cv2.triangulatePoints(self.p1, self.p2, pts1, pts2)
-
-        scaled = np.array([
-            np.maximum(((co / homogeneous[3] - offset) * scale), 0)
-            for co, offset, scale 
-            in zip(homogeneous[:3], self.offsets, self.scales)
-        ])
-
-        xyz_df = pd.DataFrame(scaled.T, columns=["x", "y", "z"])
-        xyz_df.set_index(xzyz_df.index)
+        Returns:
+            np.ndarray: (N, 3) x, y, z of each point in the tank's coordinates
+            np.ndarray: (N,) RMS reprojection error of each point in pixels
+        """
+        positions, errors = triangulate_views(self.P, points, seen)
+        return np.maximum((positions - self.offsets) * self.scales, 0), errors
 
-        return xyz_df
+    def smooth(self, ids: np.ndarray, points: np.ndarray, errors: np.ndarray, dt: float) -> Points3D:
+        """
+        Steps every 3D ID's filter by `dt` seconds and corrects those triangulated this frame
 
-    def __call__(self, tracks: List[XYTracks]) -> pd.DataFrame:
+        Args:
+            ids (np.ndarray): 3D IDs triangulated this frame
+            points (np.ndarray): (N, 3) triangulated positions of each ID
+            errors (np.ndarray): (N,) reprojection error of each ID
+        """
+        for track_id in self.motion.ids():
+            if track_id not in self.idMap or track_id in self.new_ids:
+                self.motion.remove(track_id)
+                del self.coasting[track_id]
+        self.motion.predict(dt)
+
+        for track_id in self.coasting:
+            self.coasting[track_id] += 1
+        known = np.array([track_id in self.motion for track_id in ids.tolist()], dtype=bool)
+        self.motion.update(ids[known].tolist(), points[known])
+        for track_id, point in zip(ids[~known].tolist(), points[~known]):
+            self.motion.add(track_id, point, uncertainty=200.)
+        for track_id in ids.tolist():
+            self.coasting[track_id] = 0
+
+        reported = sorted(track_id for track_id, frames in self.coasting.items() if frames <= self.max_coast)
+        _, positions = self.motion.positions(reported)
+        _, velocity = self.motion.derivative(1, reported)
+        _, acceleration = self.motion.derivative(2, reported)
+        measured = np.array([self.coasting[track_id] == 0 for track_id in reported], dtype=bool)
+        # Predicted positions have no reprojection error to report
+        frame_errors = dict(zip(ids.tolist(), errors.tolist()))
+        reported_errors = np.array([frame_errors.get(track_id, np.nan) for track_id in reported])
+
+        self.tracking = {track_id: tuple(position) for track_id, position in zip(reported, positions.tolist())}
+        return Points3D(np.array(reported, dtype=np.int64), positions, velocity, acceleration, measured, reported_errors)
+
+    def __call__(self, tracks: List[XYTracks], timestamp: float = None) -> Points3D:
         """
         Records the locations of objects 3D where possible
 
         Args:
-            tracks (List[XYTracks]): List of 2D tracks from two cameras.
+            tracks (List[XYTracks]): 2D tracks from each camera, in the order of the calibration
+            timestamp (float): When the frames were captured in seconds, to step the filters by real time
 
         Returns: 
-            pd.DataFrame: DataFrame containing 3D coordinates of tracked objects where the index corresponds to the ID
+            Points3D: Smoothed 3D coordinates, velocity and acceleration of tracked objects by ID
         """
-        if len(tracks[0]) == 0 or len(tracks[1]) == 0:
+        if all(len(camera_tracks) == 0 for camera_tracks in tracks) and len(self.motion) == 0:
             return None
 
-        deep_df = pd.DataFrame.from_dict(tracks[0], orient="index", columns=["x", "y"])
-        wide_df = pd.DataFrame.from_dict(tracks[1], orient="index", columns=["x", "y"])
+        self.update_calibration()
+        if timestamp is None or self.timestamp is None or timestamp <= self.timestamp:
+            dt = self.frame_interval
+        else:
+            dt = timestamp - self.timestamp
+        self.timestamp = timestamp
+
+        ids, points = [], []
+        for camera, camera_tracks in enumerate(tracks[:self.cameras]):
+            camera_ids, camera_points = track_arrays(camera_tracks)
+            ids.append(camera_ids)
+            points.append(self.undistort(camera, camera_points))
+        track_ids, grouped, seen = self.correspond(ids, points)
 
-        equalHeight = self.match_by_location(deep_df, wide_df)
-        self.update_internal_ids(equalHeight)
-        xzyz_df = self.merge_dataframes(wide_df, deep_df)
+        return self.smooth(track_ids, *self.triangulate_points(grouped, seen), dt)
 
-        xzyz_df.dropna(inplace=True)
+    def batch(self, frames: np.ndarray, cameras: np.ndarray, ids: np.ndarray, points: np.ndarray,
+              chunk: int = 10000) -> Iterator[Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Matches, keeps IDs for and triangulates a whole recorded session of 2D tracks
+        Points are undistorted in one pass, then matching and IDs run frame by frame since each depends on the last,
+        and every group in a chunk of frames is triangulated in a single call
+        Positions are not smoothed, so each is exactly what the calibration gives for that frame
 
-        return self.triangulate_points(xzyz_df)
+        Args:
+            frames (np.ndarray): Frame number of each row, in ascending order
+            cameras (np.ndarray): Camera of each row, in the order of the calibration
+            ids (np.ndarray): 2D ID of each row
+            points (np.ndarray): (N, 2) image coordinates of each row
+            chunk (int): Frames triangulated together
+
+        Yields:
+            np.ndarray: Frame number of each 3D point
+            np.ndarray: 3D ID of each point
+            np.ndarray: (M, 3) x, y, z of each point in the tank's coordinates
+            np.ndarray: (M,) RMS reprojection error of each point in pixels
+        """
+        # Points are undistorted up front, so the calibration is fixed for the whole session
+        self.update_calibration()
+        points = np.array(points, dtype=np.float64)
+        for camera in range(self.cameras):
+            rows = cameras == camera
+            points[rows] = self.undistort(camera, points[rows])
+
+        starts = np.flatnonzero(np.diff(frames, prepend=frames[:1] - 1))
+        ends = np.append(starts[1:], len(frames))
+
+        for first in range(0, len(starts), chunk):
+            chunk_frames, chunk_ids, chunk_points, chunk_seen = [], [], [], []
+            for start, end in zip(starts[first:first + chunk].tolist(), ends[first:first + chunk].tolist()):
+                frame_cameras, frame_ids, frame_points = cameras[start:end], ids[start:end], points[start:end]
+                track_ids, grouped, seen = self.correspond(
+                    [frame_ids[frame_cameras == camera] for camera in range(self.cameras)],
+                    [frame_points[frame_cameras == camera] for camera in range(self.cameras)])
+                chunk_frames.append(np.full(len(track_ids), frames[start]))
+                chunk_ids.append(track_ids)
+                chunk_points.append(grouped)
+                chunk_seen.append(seen)
+
+            yield (np.concatenate(chunk_frames), np.concatenate(chunk_ids),
+                   *self.triangulate_points(np.concatenate(chunk_points), np.concatenate(chunk_seen)))
 
     def __getitem__(self, track_id):
         """
@@ -1,28 +1,43 @@
 import threading
+import time
 from typing import List
 import zmq
 import numpy as np
 import cv2
+import capture
+from ring_buffer import FrameRingBuffer
 
 class Poller(threading.Thread):
     """
     Base class for a parallelised ZMQ subscriber that polls for messages.
     """
-    def __init__(self, zmq_address):
+    def __init__(self, zmq_address, new_frame: threading.Condition = None, stop_event: threading.Event = None):
         super().__init__()
         self.context = zmq.Context()
         self.socket = self.context.socket(zmq.SUB)
         self.socket.connect(zmq_address)
         self.socket.setsockopt_string(zmq.SUBSCRIBE, '')
         self._latest_data = None
-        self._stop_event = threading.Event()
+        self.sequence = 0
+        self.new_frame = new_frame if new_frame is not None else threading.Condition()
+        self._stop_event = stop_event if stop_event is not None else threading.Event()
 
     def run(self):
         while not self._stop_event.is_set():
             try:
-                self._latest_data = self.socket.recv()
+                data = self.socket.recv()
             except zmq.Again:
                 continue
+            self.handle(data, time.time())
+
+    def handle(self, data: bytes, timestamp: float):
+        """
+        Called on the polling thread for every received message.
+        """
+        with self.new_frame:
+            self.sequence += 1
+            self._latest_data = data
+            self.new_frame.notify_all()
 
     def stop(self):
         self._stop_event.set()
@@ -32,34 +47,41 @@ class Poller(threading.Thread):
 class StreamTracker(Poller):
     """
     Poller specialisation for video streams
+    Each JPEG is decoded once, on the polling thread, into a ring buffer shared with the reader.
     """
-    def __init__(self, zmq_address, resolution=(2048, 2048)):
-        super().__init__(zmq_address)
-        w, h = resolution
+    def __init__(self, zmq_address, ring: FrameRingBuffer, new_frame: threading.Condition = None, stop_event: threading.Event = None):
+        super().__init__(zmq_address, new_frame, stop_event)
+        self.ring = ring
+        h, w = ring.shape[:2]
         self.socket.setsockopt(zmq.RCVBUF, w*h*3)
         self.socket.setsockopt(zmq.CONFLATE, 1)
 
-    def get_latest_image(self):
-        if self._latest_data is None:
-            return None
-        
-        np_array = np.frombuffer(self._latest_data, dtype=np.uint8)
+    @staticmethod
+    def decode(data: bytes):
+        np_array = np.frombuffer(data, dtype=np.uint8)
         return cv2.imdecode(np_array, cv2.IMREAD_COLOR)
 
-class LatestResults:
-    """
-    Accumulates the latest results from multiple streams.
-    """
-    def __init__(self, addresses: List[str], resolution=(2048, 2048)):
-        self.pollers = [StreamTracker(address, resolution) for address in addresses]
+    def handle(self, data: bytes, timestamp: float):
+        # OpenCV releases the GIL while decoding, so pollers decode in parallel with the main loop
+        image = self.decode(data)
+        if image is None:
+            return
 
-    def start(self):
-        for poller in self.pollers:
-            poller.start()
+        slot = self.ring.slot_for_write()
+        if image.shape == slot.shape:
+            np.copyto(slot, image)
+        else:
+            h, w = slot.shape[:2]
+            cv2.resize(image, (w, h), dst=slot)
 
-    def __call__(self):
-        return [poller.get_latest_image() for poller in self.pollers]
-    
-    def stop(self):
-        for poller in self.pollers:
-            poller.stop()
\ No newline at end of file
+        with self.new_frame:
+            self.sequence = self.ring.commit(timestamp)
+            self.new_frame.notify_all()
+
+class LatestResults(capture.LatestResults):
+    """
+    Accumulates the latest results from multiple ZMQ streams.
+    Equivalent to capture.LatestResults given ZMQ addresses as sources.
+    """
+    def __init__(self, addresses: List[str], resolution=(2048, 2048), **kwargs):
+        super().__init__(addresses, resolution, **kwargs)
\ No newline at end of file